@@ -0,0 +1,262 @@
+"""Cohort analytics over stored answers, held as columnar NumPy arrays.
+
+A ``Cohort`` loads one subject's answers from an ``AttemptStore`` and on
+each ``refresh()`` appends only rows it has not seen. Counts per
+topic/level, student and question are updated from the new rows alone.
+Statistics that depend on whole attempts (item discrimination, time per
+question) are recomputed in one vectorized pass and cached until more
+rows arrive.
+"""
+import functools
+import threading
+
+import numpy as np
+
+from engine import LEVELS
+
+LEVEL_CODES = {level: i for i, level in enumerate(LEVELS)}
+
+
+class _Codes:
+    """Dense integer codes for strings, assigned in order of first appearance"""
+
+    __slots__ = ('names', 'index')
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+
+    def encode(self, values):
+        index = self.index
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(self.names)
+                self.names.append(value)
+            codes[i] = code
+        return codes
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _grow(array, size):
+    """``array`` padded with zeros along its first axis to at least ``size`` rows"""
+    if array.shape[0] >= size:
+        return array
+    return np.concatenate([array, np.zeros((size - array.shape[0],) + array.shape[1:], dtype=array.dtype)])
+
+
+def _add_counts(asked, correct, codes, is_correct, size):
+    asked = _grow(asked, size)
+    correct = _grow(correct, size)
+    asked += np.bincount(codes, minlength=size)[:len(asked)].astype(asked.dtype)
+    correct += np.bincount(codes, weights=is_correct, minlength=size)[:len(correct)].astype(correct.dtype)
+    return asked, correct
+
+
+def _locked(method):
+    """Run ``method`` under the cohort's lock so it never sees a half-applied refresh"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def mid_rank_percentiles(values, population):
+    """Percent of ``population`` below each of ``values``, counting ties as half"""
+    population = np.sort(population)
+    if population.size == 0:
+        return np.zeros(len(values))
+    below = np.searchsorted(population, values, 'left')
+    not_above = np.searchsorted(population, values, 'right')
+    return 100.0 * (below + not_above) / (2 * population.size)
+
+
+class Cohort:
+    """All recorded answers for one subject"""
+
+    def __init__(self, subject):
+        self.subject = subject
+        self.last_id = 0
+        self.tests, self.users, self.topics, self.questions = _Codes(), _Codes(), _Codes(), _Codes()
+        self.test = np.empty(0, dtype=np.int32)
+        self.user = np.empty(0, dtype=np.int32)
+        self.topic = np.empty(0, dtype=np.int32)
+        self.level = np.empty(0, dtype=np.int8)
+        self.question = np.empty(0, dtype=np.int32)
+        self.correct = np.empty(0, dtype=np.int8)
+        self.answered_at = np.empty(0, dtype=np.float64)
+        # Per question: topic, level and bank id of its first answer
+        self.question_topic = np.empty(0, dtype=np.int32)
+        self.question_level = np.empty(0, dtype=np.int8)
+        self.question_bank_id = np.empty(0, dtype=np.int64)
+        # Incrementally maintained counts
+        self.topic_level_asked = np.zeros((0, len(LEVELS)), dtype=np.int64)
+        self.topic_level_correct = np.zeros((0, len(LEVELS)), dtype=np.int64)
+        self.user_asked = np.zeros(0, dtype=np.int64)
+        self.user_correct = np.zeros(0, dtype=np.int64)
+        self.question_asked = np.zeros(0, dtype=np.int64)
+        self.question_correct = np.zeros(0, dtype=np.int64)
+        self._derived = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.correct.size
+
+    @_locked
+    def refresh(self, store):
+        """Append answers recorded since the last refresh; returns how many were added"""
+        rows = store.rows_after(self.subject, self.last_id)
+        if not rows:
+            return 0
+        ids, tests, users, topics, levels, hashes, bank_ids, correct, answered_at = zip(*rows)
+        self._append(tests, users, topics, levels, hashes, bank_ids, correct, answered_at)
+        self.last_id = ids[-1]
+        self._derived = {}
+        return len(rows)
+
+    def _append(self, tests, users, topics, levels, hashes, bank_ids, correct, answered_at):
+        n_questions = len(self.questions)
+        test = self.tests.encode(tests)
+        user = self.users.encode(users)
+        topic = self.topics.encode(topics)
+        level = np.fromiter((LEVEL_CODES[level] for level in levels), dtype=np.int8, count=len(levels))
+        question = self.questions.encode(hashes)
+        is_correct = np.asarray(correct, dtype=np.int8)
+
+        # Describe questions seen for the first time by their first answer
+        new = question >= n_questions
+        if new.any():
+            first = np.unique(question[new], return_index=True)[1]
+            rows = np.flatnonzero(new)[first]
+            self.question_topic = np.concatenate([self.question_topic, topic[rows]])
+            self.question_level = np.concatenate([self.question_level, level[rows]])
+            bank = np.array([-1 if bank_ids[i] is None else bank_ids[i] for i in rows], dtype=np.int64)
+            self.question_bank_id = np.concatenate([self.question_bank_id, bank])
+
+        n_topics = len(self.topics)
+        cell = topic * len(LEVELS) + level
+        asked, right = _add_counts(self.topic_level_asked.reshape(-1), self.topic_level_correct.reshape(-1),
+                                   cell, is_correct, n_topics * len(LEVELS))
+        self.topic_level_asked = asked.reshape(n_topics, len(LEVELS))
+        self.topic_level_correct = right.reshape(n_topics, len(LEVELS))
+        self.user_asked, self.user_correct = _add_counts(
+            self.user_asked, self.user_correct, user, is_correct, len(self.users))
+        self.question_asked, self.question_correct = _add_counts(
+            self.question_asked, self.question_correct, question, is_correct, len(self.questions))
+
+        self.test = np.concatenate([self.test, test])
+        self.user = np.concatenate([self.user, user])
+        self.topic = np.concatenate([self.topic, topic])
+        self.level = np.concatenate([self.level, level])
+        self.question = np.concatenate([self.question, question])
+        self.correct = np.concatenate([self.correct, is_correct])
+        self.answered_at = np.concatenate([self.answered_at, np.asarray(answered_at, dtype=np.float64)])
+
+    def _cached(self, name, compute):
+        value = self._derived.get(name)
+        if value is None:
+            value = self._derived[name] = compute()
+        return value
+
+    @_locked
+    def topic_accuracy(self):
+        """``(topic names, asked, accuracy)`` with topics x levels arrays; accuracy is NaN where nothing was asked"""
+        asked = self.topic_level_asked
+        with np.errstate(invalid='ignore', divide='ignore'):
+            accuracy = self.topic_level_correct / asked
+        return list(self.topics.names), asked, accuracy
+
+    @_locked
+    def item_discrimination(self):
+        """Corrected item-total correlation of every question.
+
+        Each answer is paired with the accuracy of the rest of its attempt;
+        the per-question Pearson correlation is then assembled from bincount
+        sums. NaN where a question has too little spread to say.
+        """
+        return self._cached('discrimination', self._item_discrimination)
+
+    def _item_discrimination(self):
+        n_questions = len(self.questions)
+        if n_questions == 0:
+            return np.empty(0)
+        x = self.correct.astype(np.float64)
+        test_asked = np.bincount(self.test, minlength=len(self.tests))[self.test]
+        test_correct = np.bincount(self.test, weights=x, minlength=len(self.tests))[self.test]
+        usable = test_asked > 1
+        q = self.question[usable]
+        x = x[usable]
+        y = (test_correct[usable] - x) / (test_asked[usable] - 1)
+
+        n = np.bincount(q, minlength=n_questions)
+        sx = np.bincount(q, weights=x, minlength=n_questions)
+        sy = np.bincount(q, weights=y, minlength=n_questions)
+        sxy = np.bincount(q, weights=x * y, minlength=n_questions)
+        syy = np.bincount(q, weights=y * y, minlength=n_questions)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = n * sxy - sx * sy
+            var_x = n * sx - sx * sx  # x is 0/1, so sum(x^2) == sum(x)
+            var_y = n * syy - sy * sy
+            return cov / np.sqrt(var_x * var_y)
+
+    @_locked
+    def question_stats(self, min_answers=5):
+        """Per-question table (as arrays) for questions with at least ``min_answers`` answers.
+
+        ``difficulty`` is the share of wrong answers.
+        """
+        keep = np.flatnonzero(self.question_asked >= min_answers)
+        asked = self.question_asked[keep]
+        return {
+            'question': keep,
+            'hash': [self.questions.names[i] for i in keep],
+            'topic': [self.topics.names[i] for i in self.question_topic[keep]],
+            'level': [LEVELS[i] for i in self.question_level[keep]],
+            'bank_id': self.question_bank_id[keep],
+            'answers': asked,
+            'difficulty': 1.0 - self.question_correct[keep] / np.maximum(asked, 1),
+            'discrimination': self.item_discrimination()[keep],
+        }
+
+    @_locked
+    def seconds_per_question(self):
+        """Seconds since the previous answer in the same attempt, per answer (NaN for an attempt's first)"""
+        return self._cached('seconds', self._seconds_per_question)
+
+    def _seconds_per_question(self):
+        seconds = np.full(self.answered_at.size, np.nan)
+        if seconds.size < 2:
+            return seconds
+        order = np.lexsort((self.answered_at, self.test))
+        times = self.answered_at[order]
+        same_test = self.test[order][1:] == self.test[order][:-1]
+        seconds[order[1:][same_test]] = np.diff(times)[same_test]
+        return seconds
+
+    @_locked
+    def time_distribution(self, percentiles=(10, 50, 90)):
+        """``{level: percentiles of seconds per question}`` for levels with timed answers"""
+        seconds = self.seconds_per_question()
+        result = {}
+        for code, level in enumerate(LEVELS):
+            values = seconds[(self.level == code) & ~np.isnan(seconds)]
+            if values.size:
+                result[level] = np.percentile(values, percentiles)
+        return result
+
+    @_locked
+    def student_accuracy(self):
+        """``(usernames, answers, accuracy, percentile)`` for every student in the cohort"""
+        asked = self.user_asked
+        accuracy = self.user_correct / np.maximum(asked, 1)
+        return list(self.users.names), asked, accuracy, mid_rank_percentiles(accuracy, accuracy)
+
+    @_locked
+    def percentile_of(self, accuracy):
+        """Where an accuracy (0-1) falls among the cohort's students, as a percentile"""
+        population = self.user_correct / np.maximum(self.user_asked, 1)
+        return float(mid_rank_percentiles([accuracy], population[self.user_asked > 0])[0])
@@ -1,14 +1,36 @@
 import streamlit as st
-import google.generativeai as genai
-import json
+from collections import deque
 import time
-from datetime import datetime, timedelta
-import hashlib
+from datetime import datetime
+import random
+import contextvars
+import functools
+import threading
+import uuid
+import metrics
+import numpy as np
+import settings
+from analytics import Cohort
+from attempts import AttemptStore
+from checkpoints import CheckpointStore
+from dedup import SignatureSet
+from engine import LEVELS, AdaptiveEngine
+from irt import CATEngine
+from prefetch import QuestionPool, QuestionPrefetcher
+from providers import BankProvider, FakeProvider, GeminiProvider, validate_question
+from question_bank import QuestionBank, content_hash
+from router import ModelRouter, SessionBudget, route_models, set_session_budget
+from session_memory import INTERNED, QuestionWindow, footprint
+from streaming import QuestionStreamParser
+from structure_cache import StructureCache
+from subjects import INTERVIEW_PREP
+from users import DEMO_USERS, UserStore
 
 # Page config
 st.set_page_config(page_title="Adaptive Learning System", page_icon="🎓", layout="wide")
 
 # Initialize session state
+@metrics.timed('init_session_state')
 def init_session_state():
     defaults = {
         'logged_in': False,
@@ -19,18 +41,20 @@ def init_session_state():
         'test_type': None,
         'test_duration': None,
         'test_start_time': None,
-        'questions': [],
+        'questions': QuestionWindow(settings.SESSION_QUESTION_WINDOW),
         'current_question_idx': 0,
         'test_structure': None,
-        'current_topic_idx': 0,
-        'current_level': 'easy',
-        'topic_scores': {},
-        'answers_log': [],
+        'engine': None,
+        'adaptive_mode': 'ladder',
         'test_completed': False,
-        'questions_asked': 0,
-        'correct_answers': 0,
-        'wrong_answers': 0,
         'selected_answer': None,
+        'prefetcher': None,
+        'stream_timings': [],
+        'trace': None,
+        'test_id': None,
+        'seen_index': None,
+        'budget': None,
+        'stream_finisher': None,
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -38,19 +62,58 @@ def init_session_state():
 
 init_session_state()
 
-# Dummy users database (replace with actual database)
-USERS_DB = {
-    'student1': {'password': hashlib.sha256('pass123'.encode()).hexdigest(), 'name': 'John Doe', 'semester': 3},
-    'student2': {'password': hashlib.sha256('pass456'.encode()).hexdigest(), 'name': 'Jane Smith', 'semester': 5}
-}
+# Per-session span trace for the admin view
+if settings.TRACE_ENABLED:
+    if st.session_state.trace is None:
+        st.session_state.trace = deque(maxlen=500)
+    metrics.set_trace(st.session_state.trace)
 
-# Subject structure based on semester
-SUBJECTS_BY_SEMESTER = {
-    3: ['C Programming', 'Data Structures', 'Database Management', 'Computer Networks'],
-    5: ['Operating Systems', 'Compiler Design', 'Machine Learning', 'Web Technologies']
-}
+# Model spend of this session, charged by the model router
+if st.session_state.budget is None:
+    st.session_state.budget = SessionBudget(settings.SESSION_TOKEN_BUDGET, settings.SESSION_LATENCY_BUDGET)
+set_session_budget(st.session_state.budget)
 
-INTERVIEW_PREP = ['C Programming', 'Data Structures', 'Algorithms', 'DBMS', 'Operating Systems', 'Computer Networks']
+def session_context(fn):
+    """Run ``fn`` with this session's model budget and span trace bound.
+
+    Fragment reruns and widget callbacks run on a new thread, which does not
+    have the context set above when the script started.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        set_session_budget(st.session_state.budget)
+        if settings.TRACE_ENABLED:
+            metrics.set_trace(st.session_state.trace)
+        return fn(*args, **kwargs)
+    return wrapper
+
+@st.cache_resource
+def get_user_store():
+    """Process-wide user store; the demo accounts are added unless ADAPTIVE_USERS_SEED_DEMO is off"""
+    store = UserStore(settings.USERS_PATH, iterations=settings.PASSWORD_ITERATIONS,
+                      secret=settings.SESSION_SECRET, token_ttl=settings.SESSION_TTL_SECONDS)
+    if settings.USERS_SEED_DEMO:
+        store.seed(DEMO_USERS)
+    return store
+
+def sign_in(user):
+    """Start a logged-in session for ``user`` and resume their unfinished test, if any"""
+    st.session_state.logged_in = True
+    st.session_state.user = user
+    st.session_state.page = 'dashboard'
+    restore_checkpoint(user['username'])
+
+def resume_session():
+    """Log in from the signed token in the URL, so a reconnect or another worker skips the login form"""
+    token = st.query_params.get('session')
+    if st.session_state.logged_in or not token:
+        return
+    with metrics.span('auth.resume'):
+        user = get_user_store().verify_token(token)
+    if user is None:
+        del st.query_params['session']
+    else:
+        sign_in(user)
 
 # Custom CSS
 st.markdown("""
@@ -121,17 +184,38 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def configure_gemini():
+def configure_gemini(model_name=settings.MODEL_STRONG):
     """Configure Gemini API"""
     api_key = st.secrets.get("GEMINI_API_KEY", "")
     if not api_key:
         st.error("⚠️ Please set GEMINI_API_KEY in Streamlit secrets")
         st.stop()
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash')
+    return GeminiProvider(api_key, model_name)
 
-model = configure_gemini()
+@st.cache_resource
+def create_provider(name):
+    """Build the question provider named by ADAPTIVE_PROVIDER (gemini, bank or fake)"""
+    if name == 'bank':
+        return BankProvider(get_question_bank() or QuestionBank(settings.BANK_PATH))
+    if name == 'fake':
+        # The fast route answers in half the time, like a smaller model
+        models = {
+            route: FakeProvider(
+                latency=settings.FAKE_LATENCY * (0.5 if route == 'fast' else 1.0),
+                failure_rate=settings.FAKE_FAILURE_RATE,
+                seed=settings.FAKE_SEED + (route == 'fast'),
+            )
+            for route in ('fast', 'strong')
+        }
+    else:
+        models = {'fast': configure_gemini(settings.MODEL_FAST), 'strong': configure_gemini(settings.MODEL_STRONG)}
+    return route_models(models, fallback=get_question_bank())
 
+def get_provider():
+    """This process's question provider"""
+    return create_provider(settings.PROVIDER)
+
+@metrics.timed('page.login')
 def login_page():
     """Login page"""
     st.markdown('<div class="main-header"><h1>🎓 Adaptive Learning System</h1><p>Smart Assessment Platform</p></div>', unsafe_allow_html=True)
@@ -145,12 +229,11 @@ def login_page():
         password = st.text_input("Password", type="password")
         
         if st.button("Login", use_container_width=True, type="primary"):
-            hashed_pass = hashlib.sha256(password.encode()).hexdigest()
-            if username in USERS_DB and USERS_DB[username]['password'] == hashed_pass:
-                st.session_state.logged_in = True
-                st.session_state.user = USERS_DB[username]
-                st.session_state.user['username'] = username
-                st.session_state.page = 'dashboard'
+            with metrics.span('auth.login'):
+                user = get_user_store().authenticate(username, password)
+            if user is not None:
+                st.query_params['session'] = get_user_store().issue_token(username)
+                sign_in(user)
                 st.rerun()
             else:
                 st.error("Invalid credentials!")
@@ -158,12 +241,17 @@ def login_page():
         st.markdown('</div>', unsafe_allow_html=True)
         st.info("Demo: username: student1, password: pass123")
 
+@metrics.timed('page.dashboard')
 def dashboard_page():
     """Main dashboard"""
     st.markdown(f'<div class="main-header"><h1>Welcome, {st.session_state.user["name"]}! 👋</h1><p>Semester {st.session_state.user["semester"]} | Choose your assessment</p></div>', unsafe_allow_html=True)
     
     # Logout button
     if st.button("🚪 Logout", type="secondary"):
+        shutdown_prefetcher()
+        # Tokens end up in browser history, so logging out revokes them
+        get_user_store().revoke_sessions(st.session_state.user['username'])
+        st.query_params.clear()
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
@@ -175,7 +263,7 @@ def dashboard_page():
     with col1:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.subheader("📖 Semester Subjects")
-        subjects = SUBJECTS_BY_SEMESTER[st.session_state.user['semester']]
+        subjects = st.session_state.user['subjects']
         for subject in subjects:
             if st.button(f"📌 {subject}", key=f"sem_{subject}", use_container_width=True):
                 st.session_state.selected_subject = subject
@@ -192,7 +280,13 @@ def dashboard_page():
                 st.session_state.page = 'test_config'
                 st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
+    
+    if is_instructor() and get_attempt_store() is not None:
+        if st.button("📈 Instructor Dashboard", use_container_width=True):
+            st.session_state.page = 'instructor'
+            st.rerun()
 
+@metrics.timed('page.test_config')
 def test_config_page():
     """Test configuration page"""
     st.markdown(f'<div class="main-header"><h1>Configure Test: {st.session_state.selected_subject}</h1></div>', unsafe_allow_html=True)
@@ -225,9 +319,26 @@ def test_config_page():
             st.session_state.test_duration = None
         st.markdown('</div>', unsafe_allow_html=True)
     
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("🧭 Adaptive Mode")
+    adaptive_mode = st.radio("Select how difficulty adapts:",
+                             ["Level Ladder", "Ability Estimate (IRT)"],
+                             key="adaptive_mode_radio")
+    st.session_state.adaptive_mode = 'cat' if "IRT" in adaptive_mode else 'ladder'
+    st.markdown('</div>', unsafe_allow_html=True)
+    
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.markdown("### 📊 Test Rules")
-    st.markdown("""
+    if st.session_state.adaptive_mode == 'cat':
+        st.markdown("""
+    - Each topic has **Easy, Medium, and Hard** difficulty levels
+    - The next question's level is the one that tells us most about your current ability estimate
+    - A topic ends once your ability in it is measured precisely enough
+    - **Fixed duration**: Assessment includes speed and accuracy
+    - **Variable duration**: Focus on comprehensive coverage
+    """)
+    else:
+        st.markdown("""
     - Each topic has **Easy, Medium, and Hard** difficulty levels
     - Minimum **2 questions per level** before advancing
     - **Correct answers**: Move to next level/topic
@@ -242,75 +353,286 @@ def test_config_page():
             generate_test_structure()
             st.session_state.page = 'test'
             st.session_state.test_start_time = datetime.now()
+            st.session_state.test_id = uuid.uuid4().hex
+            checkpoint_test()
+            start_attempt()
             st.rerun()
 
+def load_test_structure(subject):
+    """Ask the provider for a topic tree for ``subject``; raises on a bad response"""
+    return get_provider().generate_structure(subject)
+
+@st.cache_resource
+def get_structure_cache():
+    """Process-wide test structure cache, shared across processes through SQLite"""
+    return StructureCache(
+        settings.STRUCTURE_CACHE_PATH if settings.STRUCTURE_CACHE_SHARED else None,
+        ttl=settings.STRUCTURE_CACHE_TTL,
+        max_entries=settings.STRUCTURE_CACHE_SIZE,
+    )
+
+def pin_test_structure(subject, structure=None):
+    """Admin: keep a subject's structure (the given one or the current one) until unpinned"""
+    cache = get_structure_cache()
+    cache.pin(subject, structure if structure is not None else cache.get(subject, load_test_structure))
+
+def refresh_test_structure(subject):
+    """Admin: replace a subject's cached structure with a newly generated one"""
+    return get_structure_cache().refresh(subject, load_test_structure)
+
+@metrics.timed('generate_test_structure')
 def generate_test_structure():
     """Generate test structure with topics and subtopics"""
-    prompt = f"""For the subject "{st.session_state.selected_subject}", create a comprehensive test structure.
-    
-    Return ONLY a JSON object with this structure:
-    {{
-        "topics": [
-            {{
-                "name": "Topic Name",
-                "subtopics": ["subtopic1", "subtopic2", "subtopic3"]
-            }}
-        ]
-    }}
-    
-    Include 5-8 major topics with 3-5 subtopics each. No markdown, no explanation."""
-    
     try:
-        response = model.generate_content(prompt)
-        content = response.text.strip()
-        if content.startswith('```'):
-            content = content.split('```')[1]
-            if content.startswith('json'):
-                content = content[4:]
-        content = content.strip()
-        structure = json.loads(content)
+        structure = get_structure_cache().get(st.session_state.selected_subject, load_test_structure)
         
-        # Initialize tracking
-        st.session_state.test_structure = structure
-        st.session_state.topic_scores = {
-            topic['name']: {'easy': {'asked': 0, 'correct': 0}, 
-                          'medium': {'asked': 0, 'correct': 0}, 
-                          'hard': {'asked': 0, 'correct': 0}}
-            for topic in structure['topics']
-        }
     except Exception as e:
         st.error(f"Error: {e}")
-        st.session_state.test_structure = {"topics": [{"name": st.session_state.selected_subject, "subtopics": ["General"]}]}
-
-def generate_question(topic, subtopics, level):
-    """Generate a single question"""
-    subtopics_str = ', '.join(subtopics)
-    prompt = f"""Generate 1 multiple-choice question for "{topic}" covering subtopics: {subtopics_str} at {level} difficulty.
-    
-    Return ONLY a JSON object:
-    {{
-        "question": "Question text?",
-        "options": ["A", "B", "C", "D"],
-        "correctAnswer": 0,
-        "explanation": "Brief explanation"
-    }}
-    
-    No markdown, no explanation."""
+        structure = {"topics": [{"name": st.session_state.selected_subject, "subtopics": ["General"]}]}
     
+    # Initialize tracking
+    st.session_state.test_structure = structure
+    st.session_state.engine = create_engine([topic['name'] for topic in structure['topics']])
+
+def create_engine(topics):
+    """Adaptive engine for the mode chosen on the config page"""
+    if st.session_state.adaptive_mode == 'cat':
+        return CATEngine(
+            topics,
+            se_threshold=settings.CAT_SE_THRESHOLD,
+            min_per_topic=settings.CAT_MIN_PER_TOPIC,
+            max_per_topic=settings.CAT_MAX_PER_TOPIC,
+        )
+    return AdaptiveEngine(topics)
+
+@metrics.timed('generate_question')
+def generate_fresh_questions(subject, topic, subtopics, level):
+    """Generate questions for one state, batched unless the batch size is 1"""
     try:
-        response = model.generate_content(prompt)
-        content = response.text.strip()
-        if content.startswith('```'):
-            content = content.split('```')[1]
-            if content.startswith('json'):
-                content = content[4:]
-        content = content.strip()
-        question = json.loads(content)
-        question['topic'] = topic
-        question['level'] = level
-        return question
-    except:
+        return get_provider().generate_questions(subject, topic, subtopics, level, settings.QUESTION_BATCH_SIZE)
+    except Exception:
+        return []
+
+@st.cache_resource
+def get_question_bank():
+    """Process-wide question bank, or None when disabled"""
+    if not settings.BANK_ENABLED:
+        return None
+    return QuestionBank(settings.BANK_PATH, near_duplicate_threshold=settings.DEDUP_THRESHOLD if settings.DEDUP_ENABLED else None)
+
+def fetch_questions(subject, username, topic, subtopics, level):
+    """Questions for one state: unseen bank questions for BANK_RATIO of refills, else fresh ones saved to the bank"""
+    bank = get_question_bank()
+    if bank is None:
+        return generate_fresh_questions(subject, topic, subtopics, level)
+    questions = None
+    if random.random() < settings.BANK_RATIO:
+        questions = bank.draw(subject, topic, level, username, settings.QUESTION_BATCH_SIZE)
+    if not questions:
+        fresh = generate_fresh_questions(subject, topic, subtopics, level)
+        questions = bank.add(subject, topic, level, fresh) if fresh else []
+    if not questions:
+        # Generation failed, the token budget is spent or every fresh question was a near
+        # duplicate: replace them with anything unseen in the bank
+        questions = bank.draw(subject, topic, level, username, settings.QUESTION_BATCH_SIZE)
+    # One copy of each bank question per process, however many sessions and pools hold it
+    return [INTERNED.intern(question) for question in questions]
+
+def fetch_args(topic, level):
+    """Arguments for fetch_questions() for a topic entry of the test structure"""
+    return (st.session_state.selected_subject, st.session_state.user['username'],
+            topic['name'], topic['subtopics'], level)
+
+def new_seen_index(questions=()):
+    """Near-duplicate index of the questions a test has shown"""
+    index = SignatureSet(settings.DEDUP_THRESHOLD)
+    for question_idx, question in enumerate(questions):
+        index.add(question_idx, question)
+    return index
+
+def get_seen_index():
+    if st.session_state.seen_index is None:
+        st.session_state.seen_index = new_seen_index()
+    return st.session_state.seen_index
+
+def new_question_window(questions=()):
+    """Served questions of a test, holding only the last ADAPTIVE_SESSION_QUESTION_WINDOW"""
+    return QuestionWindow(settings.SESSION_QUESTION_WINDOW, questions)
+
+def is_repeat(question):
+    """True if the test already showed ``question`` or a near duplicate; otherwise remember it"""
+    if not settings.DEDUP_ENABLED:
+        return False
+    metrics.inc('adaptive_dedup_checks_total', 'session')
+    with metrics.span('dedup.check'):
+        repeat = get_seen_index().add_if_new(len(st.session_state.questions), question) is not None
+    if repeat:
+        metrics.inc('adaptive_dedup_rejected_total', 'session')
+    return repeat
+
+def unique_question(take):
+    """First question from ``take()`` that is not a repeat within this test, or None"""
+    for _ in range(settings.DEDUP_MAX_REPLACEMENTS + 1):
+        question = take()
+        if question is None or not is_repeat(question):
+            return question
+    return None
+
+def mark_question_seen(question):
+    """Keep a served question from being drawn from the bank for this user again"""
+    bank = get_question_bank()
+    if bank is not None:
+        bank.mark_seen(st.session_state.user['username'], question)
+
+@st.cache_resource
+def get_checkpoint_store():
+    """Process-wide checkpoint store, or None when disabled"""
+    if not settings.CHECKPOINT_ENABLED:
+        return None
+    return CheckpointStore(settings.CHECKPOINT_PATH)
+
+def checkpoint_test():
+    """Queue a checkpoint of the test's configuration, structure and position"""
+    store = get_checkpoint_store()
+    if store is None or st.session_state.test_id is None:
+        return
+    store.save_test(st.session_state.user['username'], st.session_state.test_id, {
+        'subject': st.session_state.selected_subject,
+        'test_type': st.session_state.test_type,
+        'test_duration': st.session_state.test_duration,
+        'adaptive_mode': st.session_state.adaptive_mode,
+        'test_start_time': st.session_state.test_start_time.timestamp(),
+        'test_structure': st.session_state.test_structure,
+        'current_question_idx': st.session_state.current_question_idx,
+        'selected_answer': st.session_state.selected_answer,
+    })
+
+def checkpoint_question(question_idx, answer=None):
+    """Queue a checkpoint of one served question and, once given, its answer"""
+    store = get_checkpoint_store()
+    if store is None or st.session_state.test_id is None:
+        return
+    question = st.session_state.questions[question_idx]
+    if answer is None:
+        store.save_item(st.session_state.test_id, question_idx, question)
+    else:
+        store.save_item(st.session_state.test_id, question_idx, question,
+                        answer.selected, answer.is_correct, answer.answered_at)
+
+def restore_checkpoint(username):
+    """Put ``username``'s unfinished test, if any, back into the session at its current question"""
+    store = get_checkpoint_store()
+    checkpoint = store.unfinished(username) if store is not None else None
+    if checkpoint is None:
+        return False
+    test_id, header, items = checkpoint
+    st.session_state.test_id = test_id
+    st.session_state.selected_subject = header['subject']
+    st.session_state.test_type = header['test_type']
+    st.session_state.test_duration = header['test_duration']
+    st.session_state.adaptive_mode = header['adaptive_mode']
+    st.session_state.test_start_time = datetime.fromtimestamp(header['test_start_time'])
+    st.session_state.test_structure = header['test_structure']
+    
+    # Replaying the answers rebuilds the engine exactly, without any model calls
+    engine = create_engine([topic['name'] for topic in header['test_structure']['topics']])
+    for question_idx, (question, selected, is_correct, answered_at) in enumerate(items):
+        if selected is not None:
+            engine.record(question_idx, selected, is_correct).answered_at = answered_at
+    st.session_state.engine = engine
+    questions = [question for question, _, _, _ in items]
+    # Indexed before the window drops the early questions, so they still count as seen
+    st.session_state.seen_index = new_seen_index(questions) if settings.DEDUP_ENABLED else None
+    st.session_state.questions = new_question_window(questions)
+    st.session_state.current_question_idx = header['current_question_idx']
+    st.session_state.selected_answer = header['selected_answer']
+    st.session_state.test_completed = engine.completed
+    st.session_state.page = 'results' if engine.completed else 'test'
+    return True
+
+@st.cache_resource
+def get_attempt_store():
+    """Process-wide attempt store, or None when disabled"""
+    if not settings.ATTEMPTS_ENABLED:
         return None
+    return AttemptStore(settings.ATTEMPTS_PATH, settings.ATTEMPTS_BATCH_SIZE, settings.ATTEMPTS_FLUSH_SECONDS)
+
+@st.cache_resource
+def get_cohort(subject):
+    """Process-wide analytics for one subject, refreshed incrementally from the attempt store"""
+    return Cohort(subject)
+
+def is_instructor():
+    username = st.session_state.user['username']
+    return username in settings.INSTRUCTOR_USERS or username in settings.ADMIN_USERS
+
+def start_attempt():
+    """Queue the attempt row for a newly started test"""
+    store = get_attempt_store()
+    if store is not None:
+        store.start_attempt(st.session_state.test_id, st.session_state.user['username'],
+                            st.session_state.selected_subject, st.session_state.adaptive_mode,
+                            st.session_state.test_duration, st.session_state.test_start_time.timestamp())
+
+def record_attempt_answer(question, answer):
+    """Queue one answer for the attempt store"""
+    store = get_attempt_store()
+    if store is not None and st.session_state.test_id is not None:
+        topic = st.session_state.test_structure['topics'][answer.topic_idx]['name']
+        store.record_answer(st.session_state.test_id, st.session_state.user['username'],
+                            st.session_state.selected_subject, topic, LEVELS[answer.level_idx],
+                            content_hash(question), question.get('bank_id'),
+                            answer.selected, answer.is_correct, answer.answered_at)
+
+def finish_test():
+    """Record the attempt's totals and stop offering the test for resuming"""
+    test_id = st.session_state.test_id
+    if test_id is None:
+        return
+    attempts = get_attempt_store()
+    if attempts is not None:
+        engine = st.session_state.engine
+        attempts.finish_attempt(test_id, engine.questions_asked, engine.correct_answers)
+    checkpoints = get_checkpoint_store()
+    if checkpoints is not None:
+        checkpoints.finish(test_id)
+    st.session_state.test_id = None
+
+def get_prefetcher():
+    """Get (or lazily create) this session's question pool and prefetcher"""
+    if st.session_state.prefetcher is None:
+        st.session_state.prefetcher = QuestionPrefetcher(
+            fetch_questions,
+            max_inflight=settings.PREFETCH_MAX_INFLIGHT,
+            low_water=settings.POOL_LOW_WATER,
+            pool=QuestionPool(settings.POOL_MAX_PER_STATE),
+        )
+    return st.session_state.prefetcher
+
+def shutdown_prefetcher():
+    """Stop this session's prefetch workers"""
+    if st.session_state.get('prefetcher') is not None:
+        st.session_state.prefetcher.shutdown()
+        st.session_state.prefetcher = None
+
+def next_question_states():
+    """States (topic index, level) the test can move to from the current question"""
+    engine = st.session_state.engine
+    if st.session_state.selected_answer is not None:
+        # Already answered: the next state is known
+        return [engine.current_key()]
+    return engine.next_states()
+
+def prefetch_next_questions():
+    """Refill the pool for every state the test can move to next"""
+    if not settings.PREFETCH_ENABLED:
+        return
+    topics = st.session_state.test_structure['topics']
+    requests = []
+    for topic_idx, level in next_question_states():
+        topic = topics[topic_idx]
+        requests.append(((topic['name'], level), fetch_args(topic, level)))
+    get_prefetcher().prefetch(requests)
 
 def check_time_remaining():
     """Check if time is remaining"""
@@ -324,63 +646,96 @@ def check_time_remaining():
         return remaining
     return None
 
+@metrics.timed('page.test')
 def test_page():
     """Active test page"""
     # Check time
-    time_remaining = check_time_remaining()
+    check_time_remaining()
     
     # Display timer
-    if time_remaining is not None:
-        mins = int(time_remaining)
-        secs = int((time_remaining - mins) * 60)
-        st.markdown(f'<div class="timer">⏱️ {mins:02d}:{secs:02d}</div>', unsafe_allow_html=True)
+    if st.session_state.test_duration:
+        test_timer()
     
     st.markdown(f'<div class="main-header"><h1>{st.session_state.selected_subject} Test</h1></div>', unsafe_allow_html=True)
     
-    # Progress tracker
-    current_topic = st.session_state.test_structure['topics'][st.session_state.current_topic_idx]
-    
+    question_panel()
+
+@st.fragment(run_every=settings.TIMER_REFRESH_SECONDS)
+@session_context
+def test_timer():
+    """Countdown that refreshes on its own and submits the test when time is up"""
+    time_remaining = check_time_remaining()
+    mins = int(time_remaining)
+    secs = int((time_remaining - mins) * 60)
+    st.markdown(f'<div class="timer">⏱️ {mins:02d}:{secs:02d}</div>', unsafe_allow_html=True)
+
+def progress_tracker(engine, current_topic):
+    """Question counters, current topic/level and topic progress"""
     st.markdown('<div class="progress-tracker">', unsafe_allow_html=True)
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Questions", st.session_state.questions_asked)
+        st.metric("Questions", engine.questions_asked)
     with col2:
-        st.metric("Correct", st.session_state.correct_answers)
+        st.metric("Correct", engine.correct_answers)
     with col3:
-        st.metric("Wrong", st.session_state.wrong_answers)
+        st.metric("Wrong", engine.wrong_answers)
     with col4:
-        accuracy = 0 if st.session_state.questions_asked == 0 else round((st.session_state.correct_answers / st.session_state.questions_asked) * 100, 1)
+        accuracy = 0 if engine.questions_asked == 0 else round((engine.correct_answers / engine.questions_asked) * 100, 1)
         st.metric("Accuracy", f"{accuracy}%")
     st.markdown('</div>', unsafe_allow_html=True)
     
-    st.markdown(f"**Current Topic:** {current_topic['name']} | **Level:** {st.session_state.current_level.upper()}")
-    st.progress((st.session_state.current_topic_idx + 1) / len(st.session_state.test_structure['topics']))
+    st.markdown(f"**Current Topic:** {current_topic['name']} | **Level:** {engine.level.upper()}")
+    st.progress((engine.topic_idx + 1) / len(engine.topics))
+
+@st.fragment
+@session_context
+@metrics.timed('panel.question')
+def question_panel():
+    """Progress tracker and the current question; clicks here rerun only this fragment"""
+    if st.session_state.page != 'test':
+        # The last answer finished the test
+        st.rerun()
+    
+    engine = st.session_state.engine
+    current_topic = st.session_state.test_structure['topics'][engine.topic_idx]
+    progress_tracker(engine, current_topic)
     
     # Generate question if needed
     if st.session_state.selected_answer is None and len(st.session_state.questions) == st.session_state.current_question_idx:
+        prefetcher = get_prefetcher()
+        state = (current_topic['name'], engine.level)
         with st.spinner("Generating question..."):
-            question = generate_question(
-                current_topic['name'],
-                current_topic['subtopics'],
-                st.session_state.current_level
-            )
-            if question:
-                st.session_state.questions.append(question)
-                st.rerun()
+            question = unique_question(lambda: prefetcher.take(state))
+        if question is None and settings.STREAMING_ENABLED:
+            question = stream_question(st.empty(), current_topic, engine)
+            if question is not None and is_repeat(question):
+                # Not shown, so no answer should wait for the rest of its stream
+                st.session_state.stream_finisher = None
+                question = None
+        if question is None:
+            with st.spinner("Generating question..."):
+                prefetcher.pool.add(state, fetch_questions(
+                    *fetch_args(current_topic, engine.level)
+                ))
+                question = unique_question(lambda: prefetcher.pool.take(state))
+        if question:
+            mark_question_seen(question)
+            st.session_state.questions.append(question)
+            checkpoint_question(len(st.session_state.questions) - 1)
     
     if len(st.session_state.questions) > st.session_state.current_question_idx:
-        current_q = st.session_state.questions[st.session_state.current_question_idx]
+        question_idx = st.session_state.current_question_idx
+        current_q = st.session_state.questions[question_idx]
         
         st.markdown('<div class="card">', unsafe_allow_html=True)
-        st.markdown(f"### Question {st.session_state.questions_asked + 1}")
+        st.markdown(f"### Question {engine.questions_asked + 1}")
         st.markdown(f"**{current_q['question']}**")
         
         # Display options
         for idx, option in enumerate(current_q['options']):
             if st.session_state.selected_answer is None:
-                if st.button(option, key=f"opt_{idx}", use_container_width=True):
-                    handle_answer(idx, current_q)
-                    st.rerun()
+                st.button(option, key=f"opt_{idx}", use_container_width=True,
+                          on_click=handle_answer, args=(idx, question_idx, current_q))
             else:
                 is_selected = idx == st.session_state.selected_answer
                 is_correct = idx == current_q['correctAnswer']
@@ -396,80 +751,136 @@ def test_page():
         
         if st.session_state.selected_answer is not None:
             st.info(f"**Explanation:** {current_q.get('explanation', 'N/A')}")
-            if st.button("Next Question ➡️", use_container_width=True, type="primary"):
-                st.session_state.selected_answer = None
-                st.session_state.current_question_idx += 1
-                st.rerun()
+            st.button("Next Question ➡️", use_container_width=True, type="primary", on_click=next_question)
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-def handle_answer(selected_idx, question):
+        # Get the next question ready while the student reads this one
+        if not st.session_state.test_completed:
+            prefetch_next_questions()
+    else:
+        st.warning("Could not generate a question.")
+        st.button("Try Again", use_container_width=True)
+
+def render_partial_question(placeholder, number, fields):
+    """Show whatever part of a streamed question has arrived so far"""
+    with placeholder.container():
+        st.markdown(f"### Question {number}")
+        if fields.get('question'):
+            st.markdown(f"**{fields['question']}**")
+        else:
+            st.caption("Writing question...")
+        for option in fields['options']:
+            st.info(option)
+
+@metrics.timed('stream_question')
+def stream_question(placeholder, current_topic, engine):
+    """Stream a question into ``placeholder`` and return it once it can be answered, or None on failure"""
+    subject, username, topic, subtopics, level = fetch_args(current_topic, engine.level)
+    parser = QuestionStreamParser()
+    start = time.perf_counter()
+    first_token = None
+    chunks = get_provider().stream_question(subject, topic, subtopics, level)
+    try:
+        for chunk in chunks:
+            if first_token is None and chunk:
+                first_token = time.perf_counter()
+            if parser.feed(chunk):
+                render_partial_question(placeholder, engine.questions_asked + 1, parser.fields)
+            if parser.ready:
+                break
+    except Exception:
+        placeholder.empty()
+        return None
+    placeholder.empty()
+    
+    question = validate_question(parser.fields, topic, level)
+    if question is None:
+        return None
+    st.session_state.stream_timings.append({
+        'question_idx': len(st.session_state.questions),
+        'ttft_ms': round((first_token - start) * 1000, 1),
+        'tti_ms': round((time.perf_counter() - start) * 1000, 1),
+    })
+    # The explanation is still on its way; finish reading it while the student answers
+    # (in this session's context, so the rest of the stream is charged to its budget)
+    finisher = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(finish_streamed_question, chunks, parser, question, get_question_bank(), subject, username),
+        daemon=True,
+    )
+    finisher.start()
+    st.session_state.stream_finisher = (len(st.session_state.questions), finisher)
+    return question
+
+def finish_streamed_question(chunks, parser, question, bank, subject, username):
+    """Read the rest of a streamed question, then fill in its explanation and store it in the bank"""
+    try:
+        # Read to the end (not just to the closing brace) so the call's usage is recorded
+        for chunk in chunks:
+            parser.feed(chunk)
+    except Exception:
+        pass
+    if parser.fields.get('explanation'):
+        question['explanation'] = parser.fields['explanation']
+    if bank is not None:
+        stored = bank.add(subject, question['topic'], question['level'], [question])
+        # A near duplicate is not stored; the student has in effect seen the bank question it matches
+        bank_id = (stored[0]['bank_id'] if stored
+                   else bank.match(subject, question['topic'], question['level'], question))
+        if bank_id is not None:
+            question['bank_id'] = bank_id
+            bank.mark_seen(username, question)
+
+@session_context
+def next_question():
+    """Move past the answered question"""
+    st.session_state.selected_answer = None
+    st.session_state.current_question_idx += 1
+    checkpoint_test()
+
+@session_context
+@metrics.timed('handle_answer')
+def handle_answer(selected_idx, question_idx, question):
     """Handle answer submission and adaptive logic"""
     is_correct = selected_idx == question['correctAnswer']
     st.session_state.selected_answer = selected_idx
-    st.session_state.questions_asked += 1
     
-    topic = question['topic']
-    level = question['level']
+    # A streamed question's explanation (and bank id) may still be arriving; the answer shows it
+    if st.session_state.stream_finisher is not None:
+        streamed_idx, finisher = st.session_state.stream_finisher
+        if streamed_idx == question_idx:
+            with metrics.span('stream.finish_wait'):
+                finisher.join(settings.STREAM_FINISH_TIMEOUT)
+        st.session_state.stream_finisher = None
     
-    # Update scores
-    st.session_state.topic_scores[topic][level]['asked'] += 1
-    
-    if is_correct:
-        st.session_state.correct_answers += 1
-        st.session_state.topic_scores[topic][level]['correct'] += 1
-        
-        # Adaptive logic for correct answer
-        if st.session_state.topic_scores[topic][level]['asked'] >= 2:
-            # Move to next level or topic
-            if level == 'easy':
-                st.session_state.current_level = 'medium'
-            elif level == 'medium':
-                st.session_state.current_level = 'hard'
-            else:  # hard level completed
-                # Move to next topic
-                if st.session_state.current_topic_idx < len(st.session_state.test_structure['topics']) - 1:
-                    st.session_state.current_topic_idx += 1
-                    st.session_state.current_level = 'easy'
-                else:
-                    # Test completed
-                    st.session_state.test_completed = True
-                    st.session_state.page = 'results'
-    else:
-        st.session_state.wrong_answers += 1
-        
-        # Adaptive logic for wrong answer
-        if level == 'medium':
-            st.session_state.current_level = 'easy'
-        elif level == 'hard':
-            st.session_state.current_level = 'medium'
-        # Stay at easy if wrong
-    
-    # Log answer
-    st.session_state.answers_log.append({
-        'question': question['question'],
-        'selected': question['options'][selected_idx],
-        'correct': question['options'][question['correctAnswer']],
-        'is_correct': is_correct,
-        'topic': topic,
-        'level': level,
-        'time': datetime.now()
-    })
+    engine = st.session_state.engine
+    answer = engine.record(question_idx, selected_idx, is_correct)
+    checkpoint_question(question_idx, answer)
+    record_attempt_answer(question, answer)
+    checkpoint_test()
+    if engine.completed:
+        st.session_state.test_completed = True
+        st.session_state.page = 'results'
 
+@metrics.timed('page.results')
 def results_page():
     """Results and analytics page"""
     st.markdown('<div class="main-header"><h1>📊 Test Results</h1></div>', unsafe_allow_html=True)
+    finish_test()
+    
+    engine = st.session_state.engine
     
     # Overall stats
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.markdown(f'<div class="stats-card"><h2>{st.session_state.questions_asked}</h2><p>Total Questions</p></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="stats-card"><h2>{engine.questions_asked}</h2><p>Total Questions</p></div>', unsafe_allow_html=True)
     with col2:
-        st.markdown(f'<div class="stats-card"><h2>{st.session_state.correct_answers}</h2><p>Correct</p></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="stats-card"><h2>{engine.correct_answers}</h2><p>Correct</p></div>', unsafe_allow_html=True)
     with col3:
-        st.markdown(f'<div class="stats-card"><h2>{st.session_state.wrong_answers}</h2><p>Wrong</p></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="stats-card"><h2>{engine.wrong_answers}</h2><p>Wrong</p></div>', unsafe_allow_html=True)
     with col4:
-        accuracy = 0 if st.session_state.questions_asked == 0 else round((st.session_state.correct_answers / st.session_state.questions_asked) * 100, 1)
+        accuracy = 0 if engine.questions_asked == 0 else round((engine.correct_answers / engine.questions_asked) * 100, 1)
         st.markdown(f'<div class="stats-card"><h2>{accuracy}%</h2><p>Accuracy</p></div>', unsafe_allow_html=True)
     
     # Time taken
@@ -480,25 +891,41 @@ def results_page():
         elapsed = (datetime.now() - st.session_state.test_start_time).total_seconds() / 60
         st.info(f"⏱️ **Total Time Taken:** {int(elapsed)} minutes")
     
+    # Standing in the cohort
+    store = get_attempt_store()
+    if store is not None and engine.questions_asked:
+        cohort = get_cohort(st.session_state.selected_subject)
+        cohort.refresh(store)
+        if len(cohort.users) > 1:
+            percentile = cohort.percentile_of(engine.correct_answers / engine.questions_asked)
+            st.info(f"👥 **Cohort:** your accuracy is higher than {percentile:.0f}% of {len(cohort.users)} students in this subject")
+    
     # Topic-wise performance
     st.markdown("### 📈 Topic-wise Performance")
-    for topic, scores in st.session_state.topic_scores.items():
-        if any(scores[level]['asked'] > 0 for level in ['easy', 'medium', 'hard']):
+    if isinstance(engine, CATEngine):
+        abilities, standard_errors = engine.abilities()
+    for topic_idx, (topic, scores) in enumerate(engine.topic_scores()):
+        if any(scores[level][0] > 0 for level in LEVELS):
             st.markdown(f"**{topic}**")
+            if isinstance(engine, CATEngine):
+                theta, se = abilities[topic_idx], standard_errors[topic_idx]
+                st.caption(f"Ability estimate: {theta:+.2f} ± {se:.2f}")
             cols = st.columns(3)
-            for idx, level in enumerate(['easy', 'medium', 'hard']):
+            for idx, level in enumerate(LEVELS):
+                asked, correct = scores[level]
                 with cols[idx]:
-                    if scores[level]['asked'] > 0:
-                        accuracy = round((scores[level]['correct'] / scores[level]['asked']) * 100, 1)
-                        st.metric(f"{level.upper()}", f"{scores[level]['correct']}/{scores[level]['asked']} ({accuracy}%)")
+                    if asked > 0:
+                        accuracy = round((correct / asked) * 100, 1)
+                        st.metric(f"{level.upper()}", f"{correct}/{asked} ({accuracy}%)")
     
     # Recommendations
     st.markdown("### 💡 Recommendations")
     weak_topics = []
-    for topic, scores in st.session_state.topic_scores.items():
-        for level in ['easy', 'medium', 'hard']:
-            if scores[level]['asked'] > 0:
-                accuracy = (scores[level]['correct'] / scores[level]['asked']) * 100
+    for topic, scores in engine.topic_scores():
+        for level in LEVELS:
+            asked, correct = scores[level]
+            if asked > 0:
+                accuracy = (correct / asked) * 100
                 if accuracy < 60:
                     weak_topics.append(f"{topic} ({level})")
     
@@ -509,18 +936,151 @@ def results_page():
     
     if st.button("🏠 Back to Dashboard", use_container_width=True, type="primary"):
         # Reset test state
+        shutdown_prefetcher()
         st.session_state.page = 'dashboard'
         st.session_state.selected_subject = None
         st.session_state.test_type = None
-        st.session_state.questions = []
+        st.session_state.questions = new_question_window()
+        st.session_state.seen_index = None
         st.session_state.current_question_idx = 0
-        st.session_state.questions_asked = 0
-        st.session_state.correct_answers = 0
-        st.session_state.wrong_answers = 0
+        st.session_state.engine = None
+        st.session_state.stream_timings = []
+        st.session_state.stream_finisher = None
         st.session_state.selected_answer = None
         st.session_state.test_completed = False
         st.rerun()
 
+@metrics.timed('page.instructor')
+def instructor_page():
+    """Cohort analytics for one subject across every stored attempt"""
+    st.markdown('<div class="main-header"><h1>📈 Instructor Dashboard</h1></div>', unsafe_allow_html=True)
+    
+    if st.button("← Back to Dashboard"):
+        st.session_state.page = 'dashboard'
+        st.rerun()
+    
+    store = get_attempt_store()
+    subjects = store.subjects()
+    if not subjects:
+        st.info("No attempts recorded yet.")
+        return
+    subject = st.selectbox("Subject", subjects, key="instructor_subject")
+    cohort = get_cohort(subject)
+    cohort.refresh(store)
+    
+    users, answers, accuracy, percentiles = cohort.student_accuracy()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Answers", len(cohort))
+    with col2:
+        st.metric("Students", len(users))
+    with col3:
+        st.metric("Attempts", len(cohort.tests))
+    with col4:
+        overall = 0 if not len(cohort) else round(100 * int(cohort.correct.sum()) / len(cohort), 1)
+        st.metric("Accuracy", f"{overall}%")
+    
+    st.markdown("### 📊 Accuracy by Topic and Level")
+    topics, asked, topic_accuracy = cohort.topic_accuracy()
+    st.dataframe([
+        {'topic': topic, 'answers': int(asked[i].sum()),
+         **{f"{level} %": None if np.isnan(topic_accuracy[i, j]) else round(100 * float(topic_accuracy[i, j]), 1)
+            for j, level in enumerate(LEVELS)}}
+        for i, topic in enumerate(topics)
+    ], use_container_width=True)
+    
+    st.markdown("### ⏱️ Seconds per Question")
+    st.dataframe([
+        {'level': level, 'p10': round(p10, 1), 'median': round(p50, 1), 'p90': round(p90, 1)}
+        for level, (p10, p50, p90) in cohort.time_distribution().items()
+    ], use_container_width=True)
+    
+    st.markdown("### ❓ Questions")
+    min_answers = st.slider("Minimum answers per question", 1, 50, 5, key="instructor_min_answers")
+    stats = cohort.question_stats(min_answers)
+    order = np.argsort(-stats['difficulty'], kind='stable')[:200]
+    st.dataframe([
+        {'topic': stats['topic'][i], 'level': stats['level'][i],
+         'bank id': int(stats['bank_id'][i]) if stats['bank_id'][i] >= 0 else None,
+         'answers': int(stats['answers'][i]), 'difficulty': round(float(stats['difficulty'][i]), 2),
+         'discrimination': None if np.isnan(stats['discrimination'][i]) else round(float(stats['discrimination'][i]), 2)}
+        for i in order
+    ], use_container_width=True)
+    st.caption("Difficulty is the share of wrong answers; discrimination is the correlation between getting "
+               "the question right and the rest of the attempt's score. Low or negative discrimination "
+               "marks questions worth reviewing.")
+    
+    st.markdown("### 👥 Students")
+    order = np.argsort(-accuracy, kind='stable')
+    st.dataframe([
+        {'student': users[i], 'answers': int(answers[i]), 'accuracy %': round(100 * float(accuracy[i]), 1),
+         'percentile': round(float(percentiles[i]), 1)}
+        for i in order
+    ], use_container_width=True)
+
+@st.cache_resource
+def start_metrics_exporters():
+    """Start this process's Prometheus file writer and /metrics endpoint, if configured"""
+    metrics.start_exporters(settings.METRICS_FILE, settings.METRICS_FILE_INTERVAL, settings.METRICS_PORT)
+    return True
+
+def admin_sidebar():
+    """Metrics, this session's trace and structure controls for ADAPTIVE_ADMIN_USERS"""
+    with st.sidebar:
+        st.subheader("🛠️ Admin")
+        with st.expander("Metrics"):
+            st.dataframe([
+                {'metric': metric, 'name': name, 'count': count, 'mean': round(mean, 4)}
+                for (metric, name), (count, mean) in sorted(metrics.REGISTRY.summary().items())
+            ], use_container_width=True)
+            st.download_button("Download Prometheus text", metrics.REGISTRY.render(), file_name="metrics.prom")
+        if st.session_state.trace is not None:
+            with st.expander("Session trace"):
+                st.dataframe([
+                    {'time': datetime.fromtimestamp(at).strftime('%H:%M:%S.%f')[:-3], 'span': name, 'ms': ms, 'ok': ok}
+                    for at, name, ms, ok in reversed(st.session_state.trace)
+                ], use_container_width=True)
+        provider = get_provider()
+        if isinstance(provider, ModelRouter):
+            with st.expander("Model routes"):
+                st.dataframe([
+                    {'route': route, 'latency s': None if health.latency is None else round(health.latency, 2),
+                     'slo s': health.slo, 'degraded': health.degraded, 'degradations': health.degradations}
+                    for route, health in provider.health.items()
+                ], use_container_width=True)
+                st.caption(f"Tokens this hour: {provider.budget.spent()}"
+                           + (f" of {provider.budget.limit}" if provider.budget.limit else ""))
+                budget = st.session_state.budget
+                st.caption(f"This session: {budget.tokens} tokens, {budget.seconds:.1f}s of model time")
+                st.json(provider.stats)
+        with st.expander("Session memory"):
+            report = footprint(st.session_state.to_dict())
+            st.dataframe(sorted(
+                ({'key': key, 'own KB': round(own / 1024, 1), 'shared KB': round(shared / 1024, 1)}
+                 for key, (own, shared) in report.items()),
+                key=lambda row: -row['own KB']), use_container_width=True)
+            st.caption(f"This session: {sum(own for own, _ in report.values()) / 1024:.1f} KB own, "
+                       f"{sum(shared for _, shared in report.values()) / 1024:.1f} KB shared; "
+                       f"{st.session_state.questions.start} answered questions trimmed; "
+                       f"{len(INTERNED)} questions interned in this process")
+        with st.expander("Test structures"):
+            subject = st.text_input("Subject", key="admin_subject")
+            col1, col2 = st.columns(2)
+            if col1.button("Pin", disabled=not subject):
+                pin_test_structure(subject)
+                st.success(f"Pinned {subject}")
+            if col2.button("Refresh", disabled=not subject):
+                refresh_test_structure(subject)
+                st.success(f"Regenerated {subject}")
+
+# Fail fast on a misconfigured provider (e.g. a missing API key)
+get_provider()
+start_metrics_exporters()
+resume_session()
+
+if st.session_state.logged_in and st.session_state.user['username'] in settings.ADMIN_USERS:
+    admin_sidebar()
+
 # Main router
 if not st.session_state.logged_in:
     login_page()
@@ -531,4 +1091,6 @@ elif st.session_state.page == 'test_config':
 elif st.session_state.page == 'test':
     test_page()
 elif st.session_state.page == 'results':
-    results_page()
\ No newline at end of file
+    results_page()
+elif st.session_state.page == 'instructor':
+    instructor_page()
\ No newline at end of file
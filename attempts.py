@@ -0,0 +1,240 @@
+"""Append-only store of test attempts and answers for analysis after an exam.
+
+Answers are queued and written in batches by a background thread, which
+flushes once ``batch_size`` rows are waiting or ``flush_interval`` seconds
+after the oldest one arrived. Run as a script to export answers to
+gzipped JSON lines or to compact old answers into daily aggregates::
+
+    python attempts.py export answers.jsonl.gz --subject DBMS --since 2026-01-01
+    python attempts.py compact --older-than 180
+"""
+import argparse
+import atexit
+import gzip
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    test_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    adaptive_mode TEXT NOT NULL,
+    duration_minutes INTEGER,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    questions INTEGER,
+    correct INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_user ON attempts (username, started_at);
+CREATE INDEX IF NOT EXISTS idx_attempts_subject ON attempts (subject, started_at);
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    test_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    level TEXT NOT NULL,
+    question_hash TEXT NOT NULL,
+    bank_id INTEGER,
+    selected INTEGER NOT NULL,
+    is_correct INTEGER NOT NULL,
+    answered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_user ON answers (username, answered_at);
+CREATE INDEX IF NOT EXISTS idx_answers_topic ON answers (subject, topic, level, answered_at);
+CREATE INDEX IF NOT EXISTS idx_answers_date ON answers (answered_at);
+CREATE INDEX IF NOT EXISTS idx_answers_test ON answers (test_id);
+-- Rows within a subject come back in id order, for incremental loads
+CREATE INDEX IF NOT EXISTS idx_answers_subject ON answers (subject);
+CREATE TABLE IF NOT EXISTS answer_daily (
+    day TEXT NOT NULL,
+    username TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    level TEXT NOT NULL,
+    asked INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (day, username, subject, topic, level)
+);
+"""
+
+ANSWER_COLUMNS = ('test_id', 'username', 'subject', 'topic', 'level', 'question_hash', 'bank_id',
+                  'selected', 'is_correct', 'answered_at')
+
+
+class AttemptStore:
+    """Attempts and their answers, indexed by user, subject/topic/level and date"""
+
+    def __init__(self, path, batch_size=200, flush_interval=2.0, busy_timeout=5.0):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self.stats = {'batches': 0, 'answers': 0, 'errors': 0}
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_forever, name='attempt-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush, 10.0)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def start_attempt(self, test_id, username, subject, adaptive_mode, duration_minutes, started_at):
+        self._queue.put(('start', (test_id, username, subject, adaptive_mode, duration_minutes, started_at)))
+
+    def record_answer(self, test_id, username, subject, topic, level, question_hash, bank_id,
+                      selected, is_correct, answered_at):
+        self._queue.put(('answer', (test_id, username, subject, topic, level, question_hash, bank_id,
+                                    selected, int(is_correct), answered_at)))
+
+    def finish_attempt(self, test_id, questions, correct, finished_at=None):
+        self._queue.put(('finish', (finished_at or time.time(), questions, correct, test_id)))
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is written"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def _write_forever(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1][0] != 'flush':
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        rows = {'start': [], 'answer': [], 'finish': [], 'flush': []}
+        for kind, row in batch:
+            rows[kind].append(row)
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO attempts (test_id, username, subject, adaptive_mode, duration_minutes, '
+                    'started_at) VALUES (?, ?, ?, ?, ?, ?)', rows['start'])
+                conn.executemany(
+                    f"INSERT INTO answers ({', '.join(ANSWER_COLUMNS)}) VALUES ({', '.join('?' * len(ANSWER_COLUMNS))})",
+                    rows['answer'])
+                conn.executemany('UPDATE attempts SET finished_at = ?, questions = ?, correct = ? WHERE test_id = ?',
+                                 rows['finish'])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self.stats['answers'] += len(rows['answer'])
+        except sqlite3.Error:
+            self.stats['errors'] += 1
+        self.stats['batches'] += 1
+        for done in rows['flush']:
+            done.set()
+
+    def answers(self, username=None, subject=None, topic=None, since=None, until=None):
+        """Yield answer rows as dicts, filtered by any of user, subject, topic and a time range"""
+        clauses, params = [], []
+        for column, op, value in (('username', '=', username), ('subject', '=', subject), ('topic', '=', topic),
+                                  ('answered_at', '>=', since), ('answered_at', '<', until)):
+            if value is not None:
+                clauses.append(f'{column} {op} ?')
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        cursor = self._conn().execute(f"SELECT {', '.join(ANSWER_COLUMNS)} FROM answers{where} ORDER BY id", params)
+        for row in cursor:
+            yield dict(zip(ANSWER_COLUMNS, row))
+
+    def rows_after(self, subject, after_id=0):
+        """``(id, test_id, username, topic, level, question_hash, bank_id, is_correct, answered_at)``
+        tuples for ``subject`` with ids above ``after_id``, oldest first"""
+        return self._conn().execute(
+            'SELECT id, test_id, username, topic, level, question_hash, bank_id, is_correct, answered_at '
+            'FROM answers WHERE subject = ? AND id > ? ORDER BY id', (subject, after_id)).fetchall()
+
+    def subjects(self):
+        """Subjects that have at least one recorded answer"""
+        return [subject for (subject,) in self._conn().execute('SELECT DISTINCT subject FROM answers ORDER BY subject')]
+
+    def export(self, path, **filters):
+        """Write matching answers to ``path`` as gzipped JSON lines; returns the number written"""
+        count = 0
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            for row in self.answers(**filters):
+                f.write(json.dumps(row, separators=(',', ':')) + '\n')
+                count += 1
+        return count
+
+    def compact(self, before):
+        """Fold answers older than ``before`` into per-day counts, delete them and reclaim the space"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "INSERT INTO answer_daily (day, username, subject, topic, level, asked, correct) "
+                "SELECT date(answered_at, 'unixepoch'), username, subject, topic, level, COUNT(*), SUM(is_correct) "
+                "FROM answers WHERE answered_at < ? GROUP BY 1, 2, 3, 4, 5 "
+                "ON CONFLICT (day, username, subject, topic, level) DO UPDATE SET "
+                "asked = asked + excluded.asked, correct = correct + excluded.correct",
+                (before,))
+            removed = conn.execute('DELETE FROM answers WHERE answered_at < ?', (before,)).rowcount
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('VACUUM')
+        return removed
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def main(argv=None):
+    import settings
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default=settings.ATTEMPTS_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='write answers to a gzipped JSON lines file')
+    export.add_argument('out')
+    export.add_argument('--username')
+    export.add_argument('--subject')
+    export.add_argument('--topic')
+    export.add_argument('--since', help='ISO date or datetime')
+    export.add_argument('--until', help='ISO date or datetime')
+    compact = commands.add_parser('compact', help='fold old answers into daily aggregates')
+    compact.add_argument('--older-than', type=float, required=True, help='age in days')
+    args = parser.parse_args(argv)
+
+    store = AttemptStore(args.path)
+    if args.command == 'export':
+        count = store.export(args.out, username=args.username, subject=args.subject, topic=args.topic,
+                             since=_timestamp(args.since), until=_timestamp(args.until))
+        print(f"Exported {count} answers to {args.out}")
+    else:
+        removed = store.compact(time.time() - args.older_than * 86400)
+        print(f"Compacted {removed} answers")
+
+
+if __name__ == '__main__':
+    main()
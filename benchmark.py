@@ -0,0 +1,465 @@
+"""Load test: drive the real app through the full test flow for many simulated students.
+
+Each student is a Streamlit AppTest session that logs in, starts a test and
+answers questions until the results page (or ``--max-questions``), all
+against the offline fake provider with injected latency. Students run in
+``--concurrency`` worker processes that share the SQLite stores. Results are
+written as JSON and can be checked against a previous run:
+
+    python benchmark.py --students 200 --concurrency 20 --out bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2
+
+``--simulate N`` skips Streamlit and runs N simulated students straight
+through both adaptive engines, with answers drawn from the IRT model, to
+compare test length, estimated model calls and measurement precision.
+``--logins N`` creates N users and measures password logins and session
+token checks from ``--concurrency`` threads, as an exam start would hit them.
+``session_state_kb`` is what each session's state holds at the end of its
+test; ``--question-window 0`` gives the unbounded figure to compare with.
+``--workers 1,2,4`` repeats the load test with that many worker processes,
+each on fresh stores with the rate limit and token budget shared as in
+``cluster.py``, and reports how throughput scales.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# Lower is better for every metric compared against a baseline
+REGRESSION_METRICS = [
+    'rerun_latency_ms.p50',
+    'rerun_latency_ms.p95',
+    'rerun_latency_ms.p99',
+    'first_question_ms.p50',
+    'first_question_ms.p95',
+    'llm_calls_per_test',
+    'memory_per_session_kb',
+    'session_state_kb.p95',
+    'login_ms.p95',
+    'resume_ms.p95',
+]
+
+
+def percentiles(values):
+    """p50/p95/p99/max/mean of ``values`` (nearest-rank)"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': round(rank(50), 3),
+        'p95': round(rank(95), 3),
+        'p99': round(rank(99), 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+class Student:
+    """One simulated student session"""
+
+    def __init__(self, student_id, args):
+        from streamlit.testing.v1 import AppTest
+        self.id = student_id
+        self.args = args
+        self.rng = random.Random(args.seed + student_id)
+        self.at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        self.rerun_ms = []
+        self.first_question_ms = None
+        self.stream_timings = []
+        self.answered = 0
+        self.completed = False
+        self.error = None
+        self.session_bytes = None
+        self.session_shared_bytes = None
+
+    def _run(self, widget=None):
+        start = time.perf_counter()
+        if widget is None:
+            self.at.run()
+        else:
+            widget.run()
+        self.rerun_ms.append((time.perf_counter() - start) * 1000)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].value)
+
+    def _button(self, label):
+        for button in self.at.button:
+            if button.label == label:
+                return button
+        raise RuntimeError(f"No '{label}' button on page {self.at.session_state['page']!r}")
+
+    def _state(self, key):
+        return self.at.session_state[key]
+
+    def _question_shown(self):
+        return len(self._state('questions')) > self._state('current_question_idx')
+
+    def _wait_for_question(self, attempts=20):
+        """Rerun until a question is on screen; generation can fail and be retried"""
+        for _ in range(attempts):
+            if self._question_shown():
+                return
+            self._run()
+        raise RuntimeError(f"No question after {attempts} reruns")
+
+    def _measure_session(self):
+        """Bytes held by the session's state at the end of its test, own and interned"""
+        from session_memory import footprint
+
+        report = footprint(self.at.session_state.to_dict())
+        self.session_bytes = sum(own for own, _ in report.values())
+        self.session_shared_bytes = sum(shared for _, shared in report.values())
+
+    def run(self):
+        try:
+            self._run()
+            self.at.text_input[0].input(self.args.username)
+            self.at.text_input[1].input(self.args.password)
+            self._run(self._button('Login').click())
+            self._run(self.at.button(key=f"int_{self.args.subject}").click())
+            self.at.radio(key='duration_radio').set_value('Variable Duration')
+            self.at.radio(key='adaptive_mode_radio').set_value(
+                'Ability Estimate (IRT)' if self.args.mode == 'cat' else 'Level Ladder')
+
+            start = time.perf_counter()
+            self._run(self._button('🚀 Start Test').click())
+            self._wait_for_question()
+            self.first_question_ms = (time.perf_counter() - start) * 1000
+
+            while self._state('page') == 'test' and self.answered < self.args.max_questions:
+                self._wait_for_question()
+                question = self._state('questions')[self._state('current_question_idx')]
+                if self.rng.random() < self.args.accuracy:
+                    choice = question['correctAnswer']
+                else:
+                    choice = self.rng.choice([i for i in range(len(question['options']))
+                                              if i != question['correctAnswer']])
+                self._run(self.at.button(key=f"opt_{choice}").click())
+                self.answered += 1
+                if self._state('page') == 'test':
+                    self._run(self._button('Next Question ➡️').click())
+            self.completed = self._state('page') == 'results'
+            self.stream_timings = list(self._state('stream_timings'))
+            self._measure_session()
+            if not self.completed:
+                self.error = f"Not finished after {self.answered} answers"
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        return self
+
+
+def configure_environment(args, workdir, fresh=False):
+    """Point the app at the fake provider and throwaway stores before it is first imported.
+
+    Store paths already in the environment are kept unless ``fresh``.
+    """
+    set_path = os.environ.__setitem__ if fresh else os.environ.setdefault
+    os.environ['ADAPTIVE_PROVIDER'] = 'fake'
+    os.environ['ADAPTIVE_FAKE_LATENCY'] = str(args.latency)
+    os.environ['ADAPTIVE_FAKE_FAILURE_RATE'] = str(args.failure_rate)
+    os.environ['ADAPTIVE_FAKE_SEED'] = str(args.seed)
+    if args.question_window is not None:
+        os.environ['ADAPTIVE_SESSION_QUESTION_WINDOW'] = str(args.question_window)
+    set_path('ADAPTIVE_BANK_PATH', os.path.join(workdir, 'question_bank.db'))
+    set_path('ADAPTIVE_STRUCTURE_CACHE_PATH', os.path.join(workdir, 'structure_cache.db'))
+    # Every student logs in as the same user, so one would resume another's test
+    os.environ.setdefault('ADAPTIVE_CHECKPOINTS', '0')
+    set_path('ADAPTIVE_ATTEMPTS_PATH', os.path.join(workdir, 'attempts.db'))
+    set_path('ADAPTIVE_USERS_PATH', os.path.join(workdir, 'users.db'))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(APP_PATH), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def simulate_student(student_id, args):
+    """Run one student in this worker process and return its measurements"""
+    from providers import FakeProvider
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    calls_before = FakeProvider.totals['calls']
+    failures_before = FakeProvider.totals['failures']
+    student = Student(student_id, args).run()
+    # The session is still referenced here, so its state is counted
+    memory = tracemalloc.get_traced_memory()[0] - memory_before
+    tracemalloc.stop()
+    return {
+        'completed': student.completed,
+        'error': student.error,
+        'answered': student.answered,
+        'rerun_ms': student.rerun_ms,
+        'first_question_ms': student.first_question_ms,
+        'stream_timings': student.stream_timings,
+        'llm_calls': FakeProvider.totals['calls'] - calls_before,
+        'llm_failures': FakeProvider.totals['failures'] - failures_before,
+        'memory_bytes': memory,
+        'session_bytes': student.session_bytes,
+        'session_shared_bytes': student.session_shared_bytes,
+    }
+
+
+def run_benchmark(args):
+    # AppTest sessions cannot share a process concurrently, so each worker
+    # process runs one student at a time; the SQLite stores are shared.
+    # AppTest replaces __main__ in the worker, so the task is referenced by
+    # module name rather than through this script.
+    import benchmark
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.concurrency) as pool:
+        students = list(pool.map(benchmark.simulate_student, range(args.students), [args] * args.students))
+    wall = time.perf_counter() - start
+
+    completed = [s for s in students if s['completed']]
+    answered = sum(s['answered'] for s in students)
+    reruns = [ms for s in students for ms in s['rerun_ms']]
+    calls = sum(s['llm_calls'] for s in students)
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline', 'password')},
+        'students': len(students),
+        'completed_tests': len(completed),
+        'errors': sorted({s['error'] for s in students if s['error']}),
+        'questions_answered': answered,
+        'questions_per_test': round(sum(s['answered'] for s in completed) / len(completed), 3) if completed else None,
+        'wall_seconds': round(wall, 3),
+        'throughput': {
+            'tests_per_second': round(len(completed) / wall, 3) if wall else None,
+            'reruns_per_second': round(len(reruns) / wall, 3) if wall else None,
+            'answers_per_second': round(answered / wall, 3) if wall else None,
+        },
+        'rerun_latency_ms': percentiles(reruns),
+        'first_question_ms': percentiles([s['first_question_ms'] for s in students if s['first_question_ms'] is not None]),
+        'streamed_questions': sum(len(s['stream_timings']) for s in students),
+        'stream_first_token_ms': percentiles([t['ttft_ms'] for s in students for t in s['stream_timings']]),
+        'stream_interactive_ms': percentiles([t['tti_ms'] for s in students for t in s['stream_timings']]),
+        'llm_calls': calls,
+        'llm_failures': sum(s['llm_failures'] for s in students),
+        'llm_calls_per_test': round(calls / len(completed), 3) if completed else None,
+        'memory_per_session_kb': round(sum(s['memory_bytes'] for s in students) / max(1, len(students)) / 1024, 1),
+        'session_state_kb': percentiles([s['session_bytes'] / 1024 for s in students if s['session_bytes'] is not None]),
+        'session_shared_kb': percentiles([s['session_shared_bytes'] / 1024 for s in students
+                                          if s['session_shared_bytes'] is not None]),
+    }
+
+
+def benchmark_scaling(args):
+    """The load test once per worker count in ``args.workers``, each on fresh shared stores"""
+    runs = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory(prefix='adaptive-bench-') as workdir:
+            configure_environment(args, workdir, fresh=True)
+            os.environ['ADAPTIVE_SHARED_STATE_PATH'] = os.path.join(workdir, 'shared_state.db')
+            results = run_benchmark(argparse.Namespace(**dict(vars(args), concurrency=workers)))
+        runs.append({
+            'workers': workers,
+            'completed_tests': results['completed_tests'],
+            'errors': results['errors'],
+            'wall_seconds': results['wall_seconds'],
+            'throughput': results['throughput'],
+            'rerun_latency_ms': results['rerun_latency_ms'],
+        })
+    base = runs[0]['throughput']['answers_per_second']
+    for run in runs:
+        rate = run['throughput']['answers_per_second']
+        run['speedup'] = round(rate / base, 3) if base and rate is not None else None
+        run['efficiency'] = round(run['speedup'] * runs[0]['workers'] / run['workers'], 3) if run['speedup'] else None
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline', 'password', 'concurrency')},
+        'cpus': os.cpu_count(),
+        'runs': runs,
+    }
+
+
+def simulate_engines(args):
+    """Run ``args.simulate`` IRT-model students through each engine without the app"""
+    import numpy as np
+    from engine import LEVELS, AdaptiveEngine
+    from irt import CATEngine, DISCRIMINATION, GRID, LEVEL_DIFFICULTY, LOG_P_CORRECT, LOG_P_WRONG, estimate
+    import settings
+
+    topics = [f"Topic {i + 1}" for i in range(args.topics)]
+    engines = {
+        'ladder': lambda: AdaptiveEngine(topics),
+        'cat': lambda: CATEngine(topics, se_threshold=settings.CAT_SE_THRESHOLD,
+                                 min_per_topic=settings.CAT_MIN_PER_TOPIC,
+                                 max_per_topic=settings.CAT_MAX_PER_TOPIC),
+    }
+    results = {}
+    for mode, make_engine in engines.items():
+        rng = np.random.default_rng(args.seed)
+        lengths, calls, rmse, mean_se, capped = [], [], [], [], 0
+        for _ in range(args.simulate):
+            true_theta = rng.normal(size=len(topics))
+            engine = make_engine()
+            # Every mode is scored the same way, so precision is comparable
+            log_likelihood = np.zeros((len(topics), GRID.size))
+            per_state = {}
+            while not engine.completed and engine.questions_asked < args.max_questions:
+                topic_idx, level = engine.current_key()
+                level_idx = LEVELS.index(level)
+                logit = DISCRIMINATION * (true_theta[topic_idx] - LEVEL_DIFFICULTY[level_idx])
+                is_correct = rng.random() < 1.0 / (1.0 + np.exp(-logit))
+                log_likelihood[topic_idx] += (LOG_P_CORRECT if is_correct else LOG_P_WRONG)[level_idx]
+                per_state[(topic_idx, level)] = per_state.get((topic_idx, level), 0) + 1
+                engine.record(engine.questions_asked, 0, is_correct)
+            theta, se = estimate(log_likelihood)
+            lengths.append(engine.questions_asked)
+            calls.append(sum(-(-n // settings.QUESTION_BATCH_SIZE) for n in per_state.values()))
+            rmse.append(float(np.sqrt(np.mean((theta - true_theta) ** 2))))
+            mean_se.append(float(se.mean()))
+            capped += not engine.completed
+        results[mode] = {
+            'questions_per_test': percentiles(lengths),
+            'estimated_llm_calls_per_test': round(sum(calls) / len(calls), 3),
+            'ability_rmse': round(sum(rmse) / len(rmse), 4),
+            'mean_standard_error': round(sum(mean_se) / len(mean_se), 4),
+            'hit_question_cap': capped,
+        }
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {k: v for k, v in vars(args).items() if k in ('simulate', 'topics', 'max_questions', 'seed')},
+        'modes': results,
+    }
+
+
+def benchmark_logins(args, workdir):
+    """Log ``args.logins`` users in concurrently, then resume each session from its token"""
+    import settings
+    from users import UserStore
+
+    store = UserStore(os.path.join(workdir, 'users.db'), iterations=settings.PASSWORD_ITERATIONS)
+    usernames = [f"bench{i}" for i in range(args.logins)]
+    store.add_users([(username, f"pw-{username}", username, 3, None) for username in usernames])
+
+    def timed(fn, *fn_args):
+        start = time.perf_counter()
+        result = fn(*fn_args)
+        return result, (time.perf_counter() - start) * 1000
+
+    def login(username):
+        user, ms = timed(store.authenticate, username, f"pw-{username}")
+        return store.issue_token(username) if user else None, ms
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        start = time.perf_counter()
+        logins = list(pool.map(login, usernames))
+        login_wall = time.perf_counter() - start
+        tokens = [token for token, _ in logins]
+        start = time.perf_counter()
+        resumes = list(pool.map(lambda token: timed(store.verify_token, token), tokens))
+        resume_wall = time.perf_counter() - start
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {'logins': args.logins, 'concurrency': args.concurrency,
+                   'password_iterations': settings.PASSWORD_ITERATIONS},
+        'failed_logins': sum(token is None for token in tokens),
+        'failed_resumes': sum(user is None for user, _ in resumes),
+        'throughput': {
+            'logins_per_second': round(len(logins) / login_wall, 3) if login_wall else None,
+            'resumes_per_second': round(len(resumes) / resume_wall, 3) if resume_wall else None,
+        },
+        'login_ms': percentiles([ms for _, ms in logins]),
+        'resume_ms': percentiles([ms for _, ms in resumes]),
+    }
+
+
+def lookup(results, dotted):
+    value = results
+    for part in dotted.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """Metrics that got worse than ``baseline`` by more than ``tolerance`` (a fraction)"""
+    regressions = []
+    for metric in REGRESSION_METRICS:
+        new, old = lookup(results, metric), lookup(baseline, metric)
+        if new is None or not old:
+            continue
+        if new > old * (1 + tolerance):
+            regressions.append({'metric': metric, 'baseline': old, 'current': new,
+                                'change': round(new / old - 1, 3)})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--subject', default='Data Structures', help='an interview-prep subject')
+    parser.add_argument('--mode', choices=['ladder', 'cat'], default='ladder', help='adaptive mode to select')
+    parser.add_argument('--username', default='student1')
+    parser.add_argument('--password', default='pass123')
+    parser.add_argument('--max-questions', type=int, default=150)
+    parser.add_argument('--accuracy', type=float, default=0.7, help='chance a student answers correctly')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake model latency per call, seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--question-window', type=int,
+                        help='questions each session holds (0 keeps all, to measure memory before trimming)')
+    parser.add_argument('--timeout', type=float, default=60, help='per-rerun timeout, seconds')
+    parser.add_argument('--simulate', type=int, metavar='N', help='compare the engines offline for N students')
+    parser.add_argument('--topics', type=int, default=6, help='topics per test in --simulate')
+    parser.add_argument('--logins', type=int, metavar='N', help='measure N concurrent logins and session resumes')
+    parser.add_argument('--workers', type=lambda s: [int(n) for n in s.split(',')], metavar='N,N,...',
+                        help='measure throughput scaling over these worker process counts')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline', help='earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs the baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.simulate:
+        results = simulate_engines(args)
+    elif args.workers:
+        results = benchmark_scaling(args)
+    elif args.logins:
+        with tempfile.TemporaryDirectory(prefix='adaptive-bench-') as workdir:
+            results = benchmark_logins(args, workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='adaptive-bench-') as workdir:
+            configure_environment(args, workdir)
+            results = run_benchmark(args)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
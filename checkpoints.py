@@ -0,0 +1,141 @@
+"""Durable checkpoints of in-progress tests, written by a background thread to SQLite"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (
+    test_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tests_user ON tests (username, finished, updated_at);
+CREATE TABLE IF NOT EXISTS test_items (
+    test_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    selected INTEGER,
+    is_correct INTEGER,
+    answered_at REAL,
+    PRIMARY KEY (test_id, idx)
+);
+"""
+
+
+class CheckpointStore:
+    """Per-test header rows plus one row per question served, keyed by test ID.
+
+    ``save_test``, ``save_item`` and ``finish`` only enqueue; a single writer
+    thread applies everything queued so far in one transaction, so a
+    checkpoint costs the page a queue put. Only the latest header per test
+    in a batch is written.
+    """
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self.stats = {'batches': 0, 'writes': 0, 'errors': 0}
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_forever, name='checkpoint-writer', daemon=True)
+        self._writer.start()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def save_test(self, username, test_id, header):
+        """Checkpoint a test's header (configuration, structure and position)"""
+        self._queue.put(('test', test_id, (username, json.dumps(header), time.time())))
+
+    def save_item(self, test_id, idx, question, selected=None, is_correct=None, answered_at=None):
+        """Checkpoint question ``idx`` of a test, with its answer once given"""
+        row = (json.dumps(question), selected, None if is_correct is None else int(is_correct), answered_at)
+        self._queue.put(('item', (test_id, idx), row))
+
+    def finish(self, test_id):
+        """Mark a test as finished so it is no longer offered for resuming"""
+        self._queue.put(('finish', test_id, time.time()))
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is written"""
+        done = threading.Event()
+        self._queue.put(('flush', None, done))
+        return done.wait(timeout)
+
+    def _write_forever(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        headers, items, finished, flushes = {}, {}, {}, []
+        for kind, key, value in batch:
+            if kind == 'test':
+                headers[key] = value
+            elif kind == 'item':
+                items[key] = value
+            elif kind == 'finish':
+                finished[key] = value
+            else:
+                flushes.append(value)
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT INTO tests (test_id, username, payload, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (test_id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at',
+                    [(test_id, username, payload, at) for test_id, (username, payload, at) in headers.items()])
+                conn.executemany(
+                    'INSERT OR REPLACE INTO test_items (test_id, idx, question, selected, is_correct, answered_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [key + value for key, value in items.items()])
+                conn.executemany('UPDATE tests SET finished = 1, updated_at = ? WHERE test_id = ?',
+                                 [(at, test_id) for test_id, at in finished.items()])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self.stats['writes'] += len(headers) + len(items) + len(finished)
+        except sqlite3.Error:
+            self.stats['errors'] += 1
+        self.stats['batches'] += 1
+        for done in flushes:
+            done.set()
+
+    def unfinished(self, username):
+        """The most recent unfinished test of ``username`` as ``(test_id, header, items)``, or None.
+
+        ``items`` is a list of ``(question, selected, is_correct, answered_at)`` in question order.
+        """
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT test_id, payload FROM tests WHERE username = ? AND finished = 0 '
+            'ORDER BY updated_at DESC LIMIT 1', (username,)).fetchone()
+        if row is None:
+            return None
+        test_id, payload = row
+        items = [
+            (json.loads(question), selected, None if is_correct is None else bool(is_correct), answered_at)
+            for question, selected, is_correct, answered_at in conn.execute(
+                'SELECT question, selected, is_correct, answered_at FROM test_items '
+                'WHERE test_id = ? ORDER BY idx', (test_id,))
+        ]
+        return test_id, json.loads(payload), items
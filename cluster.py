@@ -0,0 +1,104 @@
+"""Run several app workers that share every store, for a load balancer to spread students over.
+
+Each worker is a separate ``streamlit run app.py`` process on its own port.
+The question bank, structure cache, checkpoints, attempts, users and the
+model rate limits and token budget all live in SQLite files in
+``--data-dir``. The user store also holds the session-token secret, so any
+worker can pick up any student. A student whose connection moves to
+another worker is logged in from their session token and resumes their
+test from its checkpoint. A worker that exits is restarted.
+
+    python cluster.py --workers 4 --port 8501 --data-dir /var/lib/adaptive
+
+Put the workers behind a proxy that keeps each browser's websocket on one
+worker, e.g. nginx with ``ip_hash`` in the upstream (printed at start-up).
+SQLite in WAL mode needs every process on the same host; to spread over
+several hosts, give each host's workers their own ``--data-dir`` or keep
+the files on storage that supports SQLite locking.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# Store paths a worker reads from the environment, and their file names in --data-dir
+STORES = {
+    'ADAPTIVE_BANK_PATH': 'question_bank.db',
+    'ADAPTIVE_STRUCTURE_CACHE_PATH': 'structure_cache.db',
+    'ADAPTIVE_CHECKPOINT_PATH': 'checkpoints.db',
+    'ADAPTIVE_ATTEMPTS_PATH': 'attempts.db',
+    'ADAPTIVE_USERS_PATH': 'users.db',
+    'ADAPTIVE_SHARED_STATE_PATH': 'shared_state.db',
+}
+
+
+def worker_environment(data_dir, index, metrics_port=0):
+    """Environment for worker ``index``; store paths already set in the environment are kept"""
+    env = dict(os.environ)
+    for name, filename in STORES.items():
+        env.setdefault(name, os.path.join(data_dir, filename))
+    env['ADAPTIVE_STRUCTURE_CACHE_SHARED'] = '1'
+    if metrics_port:
+        env['ADAPTIVE_METRICS_PORT'] = str(metrics_port + index)
+    if env.get('ADAPTIVE_METRICS_FILE'):
+        root, ext = os.path.splitext(env['ADAPTIVE_METRICS_FILE'])
+        env['ADAPTIVE_METRICS_FILE'] = f"{root}-{index}{ext}"
+    return env
+
+
+def start_worker(args, index):
+    command = [sys.executable, '-m', 'streamlit', 'run', APP_PATH,
+               '--server.port', str(args.port + index), '--server.address', args.address,
+               '--server.headless', 'true']
+    return subprocess.Popen(command, env=worker_environment(args.data_dir, index, args.metrics_port))
+
+
+def nginx_upstream(args):
+    servers = '\n'.join(f"    server {args.address}:{args.port + i};" for i in range(args.workers))
+    return f"upstream adaptive {{\n    ip_hash;\n{servers}\n}}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--port', type=int, default=8501, help='port of the first worker')
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--data-dir', default='.', help='directory holding the shared SQLite stores')
+    parser.add_argument('--metrics-port', type=int, default=0, help='serve worker i\'s /metrics on this port + i')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.data_dir, exist_ok=True)
+    workers = [start_worker(args, i) for i in range(args.workers)]
+    print(f"Started {args.workers} workers on ports {args.port}-{args.port + args.workers - 1}\n"
+          f"{nginx_upstream(args)}", flush=True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while not stopping:
+        time.sleep(1)
+        for i, worker in enumerate(workers):
+            if worker.poll() is not None and not stopping:
+                print(f"Worker {i} exited with {worker.returncode}; restarting", flush=True)
+                workers[i] = start_worker(args, i)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
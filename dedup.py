@@ -0,0 +1,145 @@
+"""Near-duplicate detection for questions with MinHash signatures and LSH buckets.
+
+A question is reduced to word bigrams of its normalized stem plus its
+normalized options. ``NUM_PERM`` multiply-shift hashes of those shingles
+give a MinHash signature whose agreement rate estimates Jaccard
+similarity; ``BANDS`` x ``ROWS`` banding finds candidates without
+comparing against every stored question.
+"""
+import hashlib
+import re
+import threading
+
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_rng = np.random.default_rng(0x5eed)
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Lowercase words and numbers only, so case, punctuation and spacing don't matter"""
+    return ' '.join(_WORD.findall(text.lower()))
+
+
+def shingles(question):
+    words = normalize(question['question']).split()
+    grams = {' '.join(words[i:i + 2]) for i in range(max(1, len(words) - 1))}
+    grams.update('\x1f' + normalize(option) for option in question['options'])
+    return grams
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+
+def signature(question):
+    """MinHash signature (``NUM_PERM`` uint32 values) of a question"""
+    values = np.fromiter((_hash64(s) for s in shingles(question)), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        hashed = (_MULTIPLIERS[:, None] * values[None, :] + _OFFSETS[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """Signatures of stored questions, grouped by a scope such as ``(subject, topic, level)``.
+
+    ``find()`` returns the key of a stored question in the same scope whose
+    estimated similarity is at least ``threshold``, or None.
+    """
+
+    def __init__(self, threshold=0.7):
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._signatures = {}
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    @staticmethod
+    def _bands(sig):
+        return [sig[i * ROWS:(i + 1) * ROWS].tobytes() for i in range(BANDS)]
+
+    def find(self, question, scope=None, sig=None):
+        sig = signature(question) if sig is None else sig
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(self._bands(sig)):
+                candidates.update(self._buckets.get((scope, band, key), ()))
+            for key in candidates:
+                if similarity(sig, self._signatures[key]) >= self.threshold:
+                    return key
+        return None
+
+    def add(self, key, question, scope=None, sig=None):
+        sig = signature(question) if sig is None else sig
+        with self._lock:
+            self._signatures[key] = sig
+            for band, band_key in enumerate(self._bands(sig)):
+                self._buckets.setdefault((scope, band, band_key), []).append(key)
+
+    def add_if_new(self, key, question, scope=None):
+        """Add the question unless a near duplicate is stored; returns the duplicate's key or None"""
+        sig = signature(question)
+        with self._lock:
+            duplicate = self.find(question, scope, sig)
+            if duplicate is None:
+                self.add(key, question, scope, sig)
+        return duplicate
+
+
+class SignatureSet:
+    """Signatures of a few hundred questions (one test) in a growable matrix, compared by brute force.
+
+    Same ``find``/``add``/``add_if_new`` as ``NearDuplicateIndex`` without
+    scopes. Without LSH buckets a question costs 256 bytes instead of about
+    4 KB, and a scan over one test's rows is as fast as a bucket lookup.
+    """
+
+    __slots__ = ('threshold', '_keys', '_rows')
+
+    def __init__(self, threshold=0.7):
+        self.threshold = threshold
+        self._keys = []
+        self._rows = np.empty((0, NUM_PERM), dtype=np.uint32)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def find(self, question, sig=None):
+        sig = signature(question) if sig is None else sig
+        n = len(self._keys)
+        if not n:
+            return None
+        matches = np.count_nonzero(self._rows[:n] == sig, axis=1)
+        best = int(matches.argmax())
+        return self._keys[best] if matches[best] >= self.threshold * NUM_PERM else None
+
+    def add(self, key, question, sig=None):
+        sig = signature(question) if sig is None else sig
+        n = len(self._keys)
+        if n == self._rows.shape[0]:
+            rows = np.empty((max(16, 2 * n), NUM_PERM), dtype=np.uint32)
+            rows[:n] = self._rows
+            self._rows = rows
+        self._rows[n] = sig
+        self._keys.append(key)
+
+    def add_if_new(self, key, question):
+        """Add the question unless a near duplicate is stored; returns the duplicate's key or None"""
+        sig = signature(question)
+        duplicate = self.find(question, sig)
+        if duplicate is None:
+            self.add(key, question, sig)
+        return duplicate
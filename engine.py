@@ -0,0 +1,152 @@
+"""Adaptive test engine: per-topic/level counters and the easy→medium→hard transition rule.
+
+Nothing here touches Streamlit, so transitions can be simulated in bulk.
+``next_state()`` is pure; ``AdaptiveEngine`` wraps it with an answer log
+for one session.
+"""
+import time
+from array import array
+
+LEVELS = ('easy', 'medium', 'hard')
+MIN_PER_LEVEL = 2
+
+
+class EngineState:
+    """Position in the test plus asked/correct counters for every (topic, level).
+
+    Counters live in flat ``array('I')`` buffers indexed by
+    ``topic_idx * len(LEVELS) + level_idx``.
+    """
+
+    __slots__ = ('topic_idx', 'level_idx', 'asked', 'correct', 'completed')
+
+    def __init__(self, topic_idx, level_idx, asked, correct, completed=False):
+        self.topic_idx = topic_idx
+        self.level_idx = level_idx
+        self.asked = asked
+        self.correct = correct
+        self.completed = completed
+
+    @classmethod
+    def initial(cls, n_topics):
+        size = n_topics * len(LEVELS)
+        return cls(0, 0, array('I', bytes(4 * size)), array('I', bytes(4 * size)))
+
+    @property
+    def n_topics(self):
+        return len(self.asked) // len(LEVELS)
+
+    @property
+    def level(self):
+        return LEVELS[self.level_idx]
+
+    def key(self):
+        """Hashable ``(topic_idx, level)`` for the question the state asks for next"""
+        return (self.topic_idx, LEVELS[self.level_idx])
+
+    def scores(self, topic_idx, level_idx):
+        """``(asked, correct)`` for one topic and level"""
+        i = topic_idx * len(LEVELS) + level_idx
+        return self.asked[i], self.correct[i]
+
+
+class Answer:
+    """One answered question, recorded by ID rather than by copying its text"""
+
+    __slots__ = ('question_id', 'topic_idx', 'level_idx', 'selected', 'is_correct', 'answered_at')
+
+    def __init__(self, question_id, topic_idx, level_idx, selected, is_correct, answered_at=None):
+        self.question_id = question_id
+        self.topic_idx = topic_idx
+        self.level_idx = level_idx
+        self.selected = selected
+        self.is_correct = is_correct
+        self.answered_at = time.time() if answered_at is None else answered_at
+
+
+def next_state(state, answer):
+    """Return the state after ``answer``; ``state`` is left unchanged"""
+    i = answer.topic_idx * len(LEVELS) + answer.level_idx
+    asked = array('I', state.asked)
+    correct = array('I', state.correct)
+    asked[i] += 1
+    topic_idx, level_idx, completed = state.topic_idx, answer.level_idx, False
+
+    if answer.is_correct:
+        correct[i] += 1
+        if asked[i] >= MIN_PER_LEVEL:
+            if level_idx < len(LEVELS) - 1:
+                level_idx += 1
+            elif topic_idx < state.n_topics - 1:
+                topic_idx += 1
+                level_idx = 0
+            else:
+                completed = True
+    else:
+        level_idx = max(level_idx - 1, 0)
+
+    return EngineState(topic_idx, level_idx, asked, correct, completed)
+
+
+def possible_next_states(state):
+    """Distinct ``(topic_idx, level)`` keys the test can move to after the current question"""
+    keys = []
+    for is_correct in (True, False):
+        probe = Answer(None, state.topic_idx, state.level_idx, None, is_correct, 0.0)
+        following = next_state(state, probe)
+        if not following.completed and following.key() not in keys:
+            keys.append(following.key())
+    return keys
+
+
+class AdaptiveEngine:
+    """One session's test: topic names, the current state and the answer log"""
+
+    __slots__ = ('topics', 'state', 'answers')
+
+    def __init__(self, topics):
+        self.topics = tuple(topics)
+        self.state = EngineState.initial(len(self.topics))
+        self.answers = []
+
+    @property
+    def topic_idx(self):
+        return self.state.topic_idx
+
+    @property
+    def level(self):
+        return self.state.level
+
+    @property
+    def completed(self):
+        return self.state.completed
+
+    @property
+    def questions_asked(self):
+        return len(self.answers)
+
+    @property
+    def correct_answers(self):
+        return sum(self.state.correct)
+
+    @property
+    def wrong_answers(self):
+        return len(self.answers) - sum(self.state.correct)
+
+    def current_key(self):
+        return self.state.key()
+
+    def record(self, question_id, selected, is_correct):
+        """Apply an answer to the question asked in the current state"""
+        answer = Answer(question_id, self.state.topic_idx, self.state.level_idx, selected, is_correct)
+        self.state = next_state(self.state, answer)
+        self.answers.append(answer)
+        return answer
+
+    def next_states(self):
+        return possible_next_states(self.state)
+
+    def topic_scores(self):
+        """Yield ``(topic, {level: (asked, correct)})`` for every topic"""
+        for topic_idx, topic in enumerate(self.topics):
+            yield topic, {level: self.state.scores(topic_idx, level_idx) for level_idx, level in enumerate(LEVELS)}
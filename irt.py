@@ -0,0 +1,131 @@
+"""Computerized adaptive testing: per-topic ability estimates under a 2PL IRT model.
+
+Each level is treated as an item of fixed difficulty. Abilities are
+estimated for all topics at once (EAP on a grid with a standard normal
+prior), the next level is the one with maximum Fisher information at the
+current estimate, and a topic ends once its standard error drops below
+the threshold. ``CATEngine`` has the same interface as
+``engine.AdaptiveEngine`` so the app can use either.
+"""
+import time
+
+import numpy as np
+
+from engine import LEVELS, Answer
+
+LEVEL_DIFFICULTY = np.array([-1.0, 0.0, 1.0])
+DISCRIMINATION = 1.7
+GRID = np.linspace(-4.0, 4.0, 81)
+LOG_PRIOR = -0.5 * GRID ** 2
+
+# P(correct | theta) for each level (rows) at each grid point (columns)
+_P_CORRECT = 1.0 / (1.0 + np.exp(-DISCRIMINATION * (GRID[None, :] - LEVEL_DIFFICULTY[:, None])))
+LOG_P_CORRECT = np.log(_P_CORRECT)
+LOG_P_WRONG = np.log1p(-_P_CORRECT)
+
+
+def estimate(log_likelihood):
+    """EAP ability and standard error for each row of ``log_likelihood`` (topics x grid)"""
+    log_post = log_likelihood + LOG_PRIOR
+    post = np.exp(log_post - log_post.max(axis=-1, keepdims=True))
+    post /= post.sum(axis=-1, keepdims=True)
+    theta = post @ GRID
+    se = np.sqrt(np.maximum(post @ GRID ** 2 - theta ** 2, 0.0))
+    return theta, se
+
+
+def information(theta):
+    """Fisher information of each level at ``theta``"""
+    p = 1.0 / (1.0 + np.exp(-DISCRIMINATION * (theta - LEVEL_DIFFICULTY)))
+    return DISCRIMINATION ** 2 * p * (1.0 - p)
+
+
+def best_level(theta):
+    """Index of the level that is most informative at ``theta``"""
+    return int(np.argmax(information(theta)))
+
+
+class CATEngine:
+    """One session's test under CAT: ability per topic, current position and the answer log"""
+
+    __slots__ = ('topics', 'log_likelihood', 'asked', 'correct', 'topic_idx', 'level_idx',
+                 'completed', 'answers', 'se_threshold', 'min_per_topic', 'max_per_topic')
+
+    def __init__(self, topics, se_threshold=0.5, min_per_topic=2, max_per_topic=8):
+        self.topics = tuple(topics)
+        n = len(self.topics)
+        self.log_likelihood = np.zeros((n, GRID.size))
+        self.asked = np.zeros((n, len(LEVELS)), dtype=np.int32)
+        self.correct = np.zeros((n, len(LEVELS)), dtype=np.int32)
+        self.se_threshold = se_threshold
+        self.min_per_topic = min_per_topic
+        self.max_per_topic = max_per_topic
+        self.topic_idx = 0
+        self.level_idx = best_level(0.0)
+        self.completed = False
+        self.answers = []
+
+    @property
+    def level(self):
+        return LEVELS[self.level_idx]
+
+    @property
+    def questions_asked(self):
+        return len(self.answers)
+
+    @property
+    def correct_answers(self):
+        return int(self.correct.sum())
+
+    @property
+    def wrong_answers(self):
+        return len(self.answers) - self.correct_answers
+
+    def current_key(self):
+        return (self.topic_idx, self.level)
+
+    def _advance(self, row, n_asked):
+        """``(topic_idx, level_idx, completed)`` once the current topic has ``row`` and ``n_asked`` answers"""
+        theta, se = estimate(row)
+        if n_asked < self.max_per_topic and (n_asked < self.min_per_topic or se > self.se_threshold):
+            return self.topic_idx, best_level(theta), False
+        if self.topic_idx < len(self.topics) - 1:
+            return self.topic_idx + 1, best_level(0.0), False
+        return self.topic_idx, self.level_idx, True
+
+    def _outcome_row(self, is_correct):
+        table = LOG_P_CORRECT if is_correct else LOG_P_WRONG
+        return self.log_likelihood[self.topic_idx] + table[self.level_idx]
+
+    def record(self, question_id, selected, is_correct):
+        """Apply an answer to the question asked at the current topic and level"""
+        t, l = self.topic_idx, self.level_idx
+        answer = Answer(question_id, t, l, selected, is_correct, time.time())
+        self.log_likelihood[t] = self._outcome_row(is_correct)
+        self.asked[t, l] += 1
+        if is_correct:
+            self.correct[t, l] += 1
+        self.topic_idx, self.level_idx, self.completed = self._advance(self.log_likelihood[t], int(self.asked[t].sum()))
+        self.answers.append(answer)
+        return answer
+
+    def next_states(self):
+        """Distinct ``(topic_idx, level)`` keys the test can move to after the current question"""
+        n_asked = int(self.asked[self.topic_idx].sum()) + 1
+        keys = []
+        for is_correct in (True, False):
+            topic_idx, level_idx, completed = self._advance(self._outcome_row(is_correct), n_asked)
+            key = (topic_idx, LEVELS[level_idx])
+            if not completed and key not in keys:
+                keys.append(key)
+        return keys
+
+    def abilities(self):
+        """Ability estimate and standard error for every topic, as arrays"""
+        return estimate(self.log_likelihood)
+
+    def topic_scores(self):
+        """Yield ``(topic, {level: (asked, correct)})`` for every topic"""
+        for topic_idx, topic in enumerate(self.topics):
+            yield topic, {level: (int(self.asked[topic_idx, i]), int(self.correct[topic_idx, i]))
+                          for i, level in enumerate(LEVELS)}
@@ -0,0 +1,209 @@
+"""In-process timing spans, histograms and counters with Prometheus-text export.
+
+With ADAPTIVE_METRICS off, ``timed`` returns functions undecorated and
+``span`` hands back a shared no-op context manager, so instrumentation
+costs next to nothing.
+"""
+import bisect
+import contextvars
+import functools
+import http.server
+import os
+import tempfile
+import threading
+import time
+
+import settings
+
+ENABLED = settings.METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms and counters keyed by ``(metric, label value)``"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, metric, label, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            hist = self.histograms.get((metric, label))
+            if hist is None:
+                hist = self.histograms[(metric, label)] = Histogram(buckets)
+            hist.observe(value)
+
+    def inc(self, metric, label, amount=1):
+        with self._lock:
+            self.counters[(metric, label)] = self.counters.get((metric, label), 0) + amount
+
+    def render(self):
+        """Everything in Prometheus text exposition format"""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        seen = set()
+        for (metric, label), hist in histograms:
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{name="{label}",le="+Inf"}} {hist.count}')
+            lines.append(f'{metric}_sum{{name="{label}"}} {hist.sum:.6f}')
+            lines.append(f'{metric}_count{{name="{label}"}} {hist.count}')
+        for (metric, label), value in counters:
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f'{metric}{{name="{label}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """``{(metric, label): (count, mean)}`` for histograms, for a quick table view"""
+        with self._lock:
+            return {key: (hist.count, hist.sum / hist.count if hist.count else 0.0)
+                    for key, hist in self.histograms.items()}
+
+
+REGISTRY = Registry()
+
+# The trace (a bounded deque) of the session whose script is running in this context
+_trace = contextvars.ContextVar('adaptive_trace', default=None)
+
+
+def set_trace(trace):
+    """Record spans started from this thread into ``trace`` (or stop with None)"""
+    _trace.set(trace)
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        REGISTRY.observe('adaptive_span_seconds', self.name, duration)
+        if exc_type is not None:
+            REGISTRY.inc('adaptive_span_errors_total', self.name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((time.time(), self.name, round(duration * 1000, 2), exc_type is None))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Context manager timing a block under ``name``"""
+    return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name):
+    """Decorator timing every call under ``name``; a no-op when metrics are off"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def observe(metric, label, value, buckets=LATENCY_BUCKETS):
+    if ENABLED:
+        REGISTRY.observe(metric, label, value, buckets)
+
+
+def inc(metric, label, amount=1):
+    if ENABLED:
+        REGISTRY.inc(metric, label, amount)
+
+
+def write_prometheus(path):
+    """Atomically replace ``path`` with the current metrics"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporters(file_path=None, interval=15.0, port=None, host='127.0.0.1'):
+    """Start a background file writer and/or a ``/metrics`` HTTP endpoint for this process"""
+    if not ENABLED:
+        return
+    if file_path:
+        def write_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_prometheus(file_path)
+                except OSError:
+                    pass
+        threading.Thread(target=write_forever, name='metrics-writer', daemon=True).start()
+    if port:
+        try:
+            server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError:
+            # Another worker process on this host already serves the port
+            return
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
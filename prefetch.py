@@ -0,0 +1,138 @@
+"""Per-session question pool and background prefetching of upcoming questions"""
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class QuestionPool:
+    """Ready-to-serve questions for one session, grouped by state.
+
+    States are opaque hashable keys (the app uses ``(topic, level)``).
+    """
+
+    def __init__(self, max_per_state=20):
+        self._max_per_state = max(1, max_per_state)
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def add(self, state, questions):
+        """Add questions for ``state``, skipping ones already queued; the oldest are dropped beyond the cap"""
+        with self._lock:
+            slot = self._slots.setdefault(state, deque(maxlen=self._max_per_state))
+            queued = {q['question'] for q in slot}
+            for question in questions:
+                if question['question'] not in queued:
+                    queued.add(question['question'])
+                    slot.append(question)
+
+    def take(self, state):
+        """Pop the next question for ``state``, or None if the slot is empty"""
+        with self._lock:
+            slot = self._slots.get(state)
+            return slot.popleft() if slot else None
+
+    def size(self, state):
+        with self._lock:
+            slot = self._slots.get(state)
+            return len(slot) if slot else 0
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+
+
+class QuestionPrefetcher:
+    """Refills a QuestionPool for the likely next states on a small per-session worker pool.
+
+    ``fetch_fn(*args)`` returns a list of questions (a batch). A state is
+    refilled once its slot falls below ``low_water``, so unused questions
+    for a branch the student did not follow stay available if the test
+    comes back to that state.
+    """
+
+    def __init__(self, fetch_fn, max_inflight=2, low_water=1, pool=None):
+        self.pool = pool if pool is not None else QuestionPool()
+        self._fetch = fetch_fn
+        self._max_inflight = max(1, max_inflight)
+        self._low_water = max(1, low_water)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_inflight,
+                                            thread_name_prefix='prefetch')
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._closed = False
+        self.stats = {'scheduled': 0, 'hits': 0, 'misses': 0, 'cancelled': 0, 'failed': 0}
+
+    def prefetch(self, requests):
+        """Schedule ``(state, args)`` refills; pending work for other states is cancelled"""
+        wanted = [state for state, _ in requests]
+        with self._lock:
+            if self._closed:
+                return
+            for state, future in list(self._pending.items()):
+                if state not in wanted and future.cancel():
+                    self._pending.pop(state, None)
+                    self.stats['cancelled'] += 1
+
+            for state, args in requests:
+                if state in self._pending or self.pool.size(state) >= self._low_water:
+                    continue
+                if len(self._pending) >= self._max_inflight:
+                    break
+                # Run in the caller's context so per-session state (trace, budget) follows the work
+                future = self._executor.submit(contextvars.copy_context().run, self._fetch, *args)
+                self._pending[state] = future
+                self.stats['scheduled'] += 1
+                future.add_done_callback(lambda f, s=state: self._on_done(s, f))
+
+    def _on_done(self, state, future):
+        """Move a finished refill's questions into the pool; only the first call for a future does anything"""
+        with self._lock:
+            if self._pending.get(state) is not future:
+                return
+            del self._pending[state]
+            if future.cancelled():
+                return
+            try:
+                questions = future.result()
+            except Exception:
+                questions = None
+            if not questions:
+                self.stats['failed'] += 1
+                return
+            self.pool.add(state, questions)
+
+    def take(self, state, timeout=None):
+        """Return a pooled question for ``state``, waiting on an in-flight refill if there is one"""
+        question = self.pool.take(state)
+        if question is None:
+            with self._lock:
+                future = self._pending.get(state)
+            if future is not None:
+                try:
+                    future.result(timeout=timeout)
+                except FutureTimeout:
+                    pass
+                except Exception:
+                    pass
+                if future.done():
+                    # The done callback may not have run yet; whichever of the two comes first fills the pool
+                    self._on_done(state, future)
+                question = self.pool.take(state)
+
+        with self._lock:
+            self.stats['hits' if question is not None else 'misses'] += 1
+        return question
+
+    def inflight(self):
+        """Number of generation calls currently queued or running"""
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self):
+        """Cancel pending work and release the worker threads"""
+        with self._lock:
+            self._closed = True
+            self._pending.clear()
+        self.pool.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
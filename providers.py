@@ -0,0 +1,321 @@
+"""Question providers: where test structures and questions come from"""
+import hashlib
+import json
+import random
+import threading
+import time
+
+import metrics
+
+
+class ProviderError(Exception):
+    """A provider could not produce a usable response"""
+
+
+@metrics.timed('json.parse')
+def parse_model_json(text):
+    """Parse a JSON model response, stripping markdown code fences"""
+    content = text.strip()
+    if content.startswith('```'):
+        content = content.split('```')[1]
+        if content.startswith('json'):
+            content = content[4:]
+    return json.loads(content.strip())
+
+
+def validate_question(item, topic, level):
+    """Return a cleaned question dict, or None if the item is malformed"""
+    if not isinstance(item, dict):
+        return None
+    text = item.get('question')
+    options = item.get('options')
+    if not isinstance(text, str) or not text.strip():
+        return None
+    if not isinstance(options, list) or len(options) < 2 or not all(isinstance(o, str) and o.strip() for o in options):
+        return None
+    try:
+        correct = int(item.get('correctAnswer'))
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= correct < len(options):
+        return None
+    return {
+        'question': text.strip(),
+        'options': options,
+        'correctAnswer': correct,
+        'explanation': item.get('explanation') or 'N/A',
+        'topic': topic,
+        'level': level,
+    }
+
+
+def validate_structure(structure, subject):
+    """Raise ProviderError unless ``structure`` has at least one usable topic"""
+    topics = structure.get('topics') if isinstance(structure, dict) else None
+    if not topics or not all(isinstance(t, dict) and t.get('name') and t.get('subtopics') for t in topics):
+        raise ProviderError(f"No topics in test structure for {subject}")
+    return structure
+
+
+# Tokens used by model calls made from this thread since the last take_usage()
+_usage = threading.local()
+
+
+def add_usage(tokens):
+    _usage.tokens = getattr(_usage, 'tokens', 0) + tokens
+
+
+def take_usage():
+    """Tokens used by this thread's model calls since the previous call, resetting the count"""
+    tokens = getattr(_usage, 'tokens', 0)
+    _usage.tokens = 0
+    return tokens
+
+
+def record_usage(prompt, response):
+    """Payload sizes and token counts (from Gemini usage metadata) for one model call"""
+    usage = getattr(response, 'usage_metadata', None)
+    add_usage(getattr(usage, 'total_token_count', None) or 0)
+    if not metrics.ENABLED:
+        return
+    metrics.observe('adaptive_model_payload_bytes', 'prompt', len(prompt.encode()), metrics.SIZE_BUCKETS)
+    try:
+        metrics.observe('adaptive_model_payload_bytes', 'response', len(response.text.encode()), metrics.SIZE_BUCKETS)
+    except (AttributeError, ValueError):
+        pass
+    if usage is None:
+        return
+    for label, field in (('prompt', 'prompt_token_count'), ('completion', 'candidates_token_count'),
+                         ('total', 'total_token_count')):
+        count = getattr(usage, field, None)
+        if count:
+            metrics.observe('adaptive_model_tokens', label, count, metrics.TOKEN_BUCKETS)
+            metrics.inc('adaptive_model_tokens_total', label, count)
+
+
+class QuestionProvider:
+    """Interface every backend implements.
+
+    ``generate_structure`` returns ``{"topics": [{"name", "subtopics"}]}`` and
+    ``generate_questions`` returns a list of validated question dicts; both
+    raise ProviderError (or any exception) on failure. ``stream_question``
+    yields the raw JSON text of one question in chunks as it is produced.
+    """
+
+    name = 'base'
+
+    def generate_structure(self, subject):
+        raise NotImplementedError
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        raise NotImplementedError
+
+    def stream_question(self, subject, topic, subtopics, level):
+        questions = self.generate_questions(subject, topic, subtopics, level, 1)
+        if not questions:
+            raise ProviderError("No question generated")
+        yield json.dumps(questions[0])
+
+
+class GeminiProvider(QuestionProvider):
+    """Generates structures and questions with a Gemini model"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name='gemini-2.5-flash'):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def _generate_json(self, prompt):
+        with metrics.span('model.call'):
+            response = self.model.generate_content(prompt)
+        record_usage(prompt, response)
+        return parse_model_json(response.text)
+
+    @staticmethod
+    def _question_prompt(topic, subtopics, level):
+        subtopics_str = ', '.join(subtopics)
+        return f"""Generate 1 multiple-choice question for "{topic}" covering subtopics: {subtopics_str} at {level} difficulty.
+
+    Return ONLY a JSON object:
+    {{
+        "question": "Question text?",
+        "options": ["A", "B", "C", "D"],
+        "correctAnswer": 0,
+        "explanation": "Brief explanation"
+    }}
+
+    No markdown, no explanation."""
+
+    def generate_structure(self, subject):
+        prompt = f"""For the subject "{subject}", create a comprehensive test structure.
+
+    Return ONLY a JSON object with this structure:
+    {{
+        "topics": [
+            {{
+                "name": "Topic Name",
+                "subtopics": ["subtopic1", "subtopic2", "subtopic3"]
+            }}
+        ]
+    }}
+
+    Include 5-8 major topics with 3-5 subtopics each. No markdown, no explanation."""
+        return validate_structure(self._generate_json(prompt), subject)
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        if count == 1:
+            question = validate_question(self._generate_json(self._question_prompt(topic, subtopics, level)), topic, level)
+            return [question] if question else []
+
+        subtopics_str = ', '.join(subtopics)
+        prompt = f"""Generate {count} different multiple-choice questions for "{topic}" covering subtopics: {subtopics_str} at {level} difficulty.
+
+    Return ONLY a JSON object:
+    {{
+        "questions": [
+            {{
+                "question": "Question text?",
+                "options": ["A", "B", "C", "D"],
+                "correctAnswer": 0,
+                "explanation": "Brief explanation"
+            }}
+        ]
+    }}
+
+    No markdown, no explanation."""
+        data = self._generate_json(prompt)
+        items = data.get('questions', []) if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ProviderError("Batch response has no question list")
+        questions = []
+        for item in items:
+            question = validate_question(item, topic, level)
+            if question is not None:
+                questions.append(question)
+        return questions
+
+    def stream_question(self, subject, topic, subtopics, level):
+        prompt = self._question_prompt(topic, subtopics, level)
+        with metrics.span('model.stream'):
+            response = self.model.generate_content(prompt, stream=True)
+            for chunk in response:
+                yield chunk.text
+        record_usage(prompt, response)
+
+
+class BankProvider(QuestionProvider):
+    """Serves only what is already in the question bank; never calls a model"""
+
+    name = 'bank'
+
+    def __init__(self, bank):
+        self.bank = bank
+
+    def generate_structure(self, subject):
+        return validate_structure({'topics': self.bank.topics(subject)}, subject)
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        return self.bank.draw(subject, topic, level, None, count)
+
+
+# Words for synthetic question text, varied enough that distinct questions are not near duplicates
+FAKE_WORDS = (
+    'array', 'pointer', 'stack', 'queue', 'heap', 'tree', 'graph', 'hash', 'table', 'index', 'query', 'join',
+    'lock', 'thread', 'process', 'page', 'cache', 'buffer', 'socket', 'packet', 'route', 'frame', 'token',
+    'parser', 'lexer', 'grammar', 'register', 'kernel', 'signal', 'mutex', 'schema', 'record', 'key', 'node',
+    'edge', 'path', 'cycle', 'sort', 'merge', 'search', 'binary', 'linear', 'recursion', 'loop', 'branch',
+    'compile', 'link', 'memory', 'disk', 'file', 'block', 'latency', 'bandwidth', 'protocol', 'layer', 'model',
+    'vector', 'matrix', 'gradient', 'weight', 'class', 'object', 'method', 'scope',
+)
+
+
+class FakeProvider(QuestionProvider):
+    """Deterministic offline stand-in for a model, for benchmarks and load tests.
+
+    Output depends only on the inputs and ``seed``. ``latency`` seconds are
+    slept per call and ``failure_rate`` of calls raise ProviderError.
+    ``totals`` counts calls across every instance in the process, so a
+    benchmark can read them without a handle on the app's provider.
+    """
+
+    name = 'fake'
+    totals = {'calls': 0, 'failures': 0}
+    _totals_lock = threading.Lock()
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0, topics=6, subtopics=4):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.topics = topics
+        self.subtopics = subtopics
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _rng(self, *parts):
+        digest = hashlib.sha256('\x1f'.join(map(str, (self.seed,) + parts)).encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def _call(self, *parts, latency=None):
+        """Simulate one model call; returns how many calls were made for these inputs so far"""
+        with self._lock:
+            call = self._calls[parts] = self._calls.get(parts, 0) + 1
+        with self._totals_lock:
+            self.totals['calls'] += 1
+        latency = self.latency if latency is None else latency
+        with metrics.span('model.call'):
+            if latency:
+                time.sleep(latency)
+        if self.failure_rate and self._rng('failure', call, *parts).random() < self.failure_rate:
+            with self._totals_lock:
+                self.totals['failures'] += 1
+            raise ProviderError("Synthetic provider failure")
+        return call
+
+    @staticmethod
+    def _use_tokens(result):
+        """Charge roughly what a model would: a fixed prompt plus four characters per output token"""
+        add_usage(150 + len(json.dumps(result)) // 4)
+        return result
+
+    def generate_structure(self, subject):
+        self._call('structure', subject)
+        return self._use_tokens({'topics': [
+            {'name': f"{subject} Topic {t + 1}",
+             'subtopics': [f"{subject} Topic {t + 1}.{s + 1}" for s in range(self.subtopics)]}
+            for t in range(self.topics)
+        ]})
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        batch = self._call('questions', subject, topic, level)
+        return self._use_tokens(self._questions(subject, topic, subtopics, level, count, batch))
+
+    def stream_question(self, subject, topic, subtopics, level):
+        """Yield the question's JSON in small chunks, spreading the latency like token output"""
+        chunks = 10
+        batch = self._call('questions', subject, topic, level, latency=self.latency / chunks)
+        questions = self._questions(subject, topic, subtopics, level, 1, batch)
+        text = json.dumps(questions[0])
+        size = -(-len(text) // chunks)
+        for i in range(0, len(text), size):
+            if i and self.latency:
+                time.sleep(self.latency / chunks)
+            yield text[i:i + size]
+        # Usage metadata arrives with the end of a real stream
+        self._use_tokens(questions)
+
+    def _questions(self, subject, topic, subtopics, level, count, batch):
+        questions = []
+        for i in range(count):
+            rng = self._rng(subject, topic, level, batch, i)
+            subtopic = subtopics[rng.randrange(len(subtopics))] if subtopics else topic
+            questions.append({
+                'question': f"[{level}] {subtopic}: {' '.join(rng.sample(FAKE_WORDS, 8))} ({batch}-{i + 1})?",
+                'options': [' '.join(rng.sample(FAKE_WORDS, 2)) for _ in range(4)],
+                'correctAnswer': rng.randrange(4),
+                'explanation': f"Synthetic explanation for {subtopic}",
+                'topic': topic,
+                'level': level,
+            })
+        return questions
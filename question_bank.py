@@ -0,0 +1,182 @@
+"""Persistent question bank shared by every session, backed by SQLite"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import metrics
+from dedup import NearDuplicateIndex, signature
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    level TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_state ON questions (subject, topic, level);
+CREATE TABLE IF NOT EXISTS seen (
+    username TEXT NOT NULL,
+    question_id INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (username, question_id)
+);
+"""
+
+
+def content_hash(question):
+    """Stable hash of a question's text and options, used to skip duplicates"""
+    text = ' '.join(question['question'].lower().split())
+    options = '\x1f'.join(' '.join(o.lower().split()) for o in question['options'])
+    return hashlib.sha256(f"{text}\x1e{options}".encode()).hexdigest()
+
+
+class QuestionBank:
+    """Questions indexed by (subject, topic, level) and content hash.
+
+    Each thread gets its own connection; the database runs in WAL mode so
+    prefetch workers and page reruns can read while another thread writes.
+    Served questions carry a ``bank_id`` so they can be marked as seen.
+    With ``near_duplicate_threshold``, new questions whose MinHash
+    similarity to one already stored for the same state reaches the
+    threshold are dropped; each state's signatures are loaded on first use.
+    """
+
+    def __init__(self, path, busy_timeout=5.0, near_duplicate_threshold=None):
+        self.path = path
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._near = None if near_duplicate_threshold is None else NearDuplicateIndex(near_duplicate_threshold)
+        self._indexed = set()
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'duplicates': 0, 'near_duplicates': 0}
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _index_state(self, scope):
+        """Load the signatures of a state's stored questions into the near-duplicate index, once"""
+        with self._lock:
+            if scope in self._indexed:
+                return
+            self._indexed.add(scope)
+        rows = self._conn().execute('SELECT id, payload FROM questions WHERE subject = ? AND topic = ? AND level = ?',
+                                    scope).fetchall()
+        for bank_id, payload in rows:
+            self._near.add(bank_id, json.loads(payload), scope)
+
+    def _near_duplicate(self, conn, scope, question, digest):
+        """True if ``question`` is a near (not exact) duplicate of a stored one for the state"""
+        sig = signature(question)
+        match = self._near.find(question, scope, sig)
+        metrics.inc('adaptive_dedup_checks_total', 'bank')
+        if match is None:
+            return False
+        exact = conn.execute('SELECT 1 FROM questions WHERE content_hash = ?', (digest,)).fetchone()
+        return exact is None
+
+    def add(self, subject, topic, level, questions):
+        """Store new questions and return them tagged with their ``bank_id``; near duplicates are left out"""
+        conn = self._conn()
+        stored = []
+        now = time.time()
+        scope = (subject, topic, level)
+        if self._near is not None:
+            self._index_state(scope)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for question in questions:
+                digest = content_hash(question)
+                if self._near is not None and self._near_duplicate(conn, scope, question, digest):
+                    self._count('near_duplicates')
+                    metrics.inc('adaptive_dedup_rejected_total', 'bank_near')
+                    continue
+                payload = {k: v for k, v in question.items() if k != 'bank_id'}
+                cur = conn.execute(
+                    'INSERT OR IGNORE INTO questions (subject, topic, level, content_hash, payload, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (subject, topic, level, digest, json.dumps(payload), now))
+                if cur.rowcount:
+                    bank_id = cur.lastrowid
+                    self._count('stored')
+                    if self._near is not None:
+                        self._near.add(bank_id, payload, scope)
+                else:
+                    bank_id = conn.execute('SELECT id FROM questions WHERE content_hash = ?',
+                                           (digest,)).fetchone()[0]
+                    self._count('duplicates')
+                    metrics.inc('adaptive_dedup_rejected_total', 'bank_exact')
+                stored.append(dict(payload, bank_id=bank_id))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return stored
+
+    def match(self, subject, topic, level, question):
+        """``bank_id`` of the stored question ``question`` duplicates (exactly or nearly) for the state, or None"""
+        row = self._conn().execute('SELECT id FROM questions WHERE content_hash = ?',
+                                   (content_hash(question),)).fetchone()
+        if row is not None or self._near is None:
+            return row and row[0]
+        scope = (subject, topic, level)
+        self._index_state(scope)
+        return self._near.find(question, scope)
+
+    def draw(self, subject, topic, level, username, limit):
+        """Return up to ``limit`` random questions for the state that ``username`` has not seen"""
+        rows = self._conn().execute(
+            'SELECT id, payload FROM questions q '
+            'WHERE subject = ? AND topic = ? AND level = ? '
+            'AND NOT EXISTS (SELECT 1 FROM seen s WHERE s.username = ? AND s.question_id = q.id) '
+            'ORDER BY RANDOM() LIMIT ?',
+            (subject, topic, level, username, limit)).fetchall()
+        self._count('hits' if rows else 'misses')
+        return [dict(json.loads(payload), bank_id=bank_id) for bank_id, payload in rows]
+
+    def mark_seen(self, username, question):
+        """Record that ``username`` was shown ``question`` so it is not drawn for them again"""
+        bank_id = question.get('bank_id')
+        if bank_id is None:
+            return
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR IGNORE INTO seen (username, question_id, seen_at) VALUES (?, ?, ?)',
+                         (username, bank_id, time.time()))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def topics(self, subject):
+        """Topics stored for ``subject`` in the ``{"name", "subtopics"}`` shape of a test structure"""
+        rows = self._conn().execute('SELECT DISTINCT topic FROM questions WHERE subject = ? ORDER BY topic',
+                                    (subject,)).fetchall()
+        return [{'name': topic, 'subtopics': [topic]} for (topic,) in rows]
+
+    def count(self, subject=None, topic=None, level=None):
+        """Number of stored questions, optionally filtered by state"""
+        clauses, params = [], []
+        for column, value in (('subject', subject), ('topic', topic), ('level', level)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return self._conn().execute(f'SELECT COUNT(*) FROM questions{where}', params).fetchone()[0]
@@ -0,0 +1,212 @@
+"""Rate limiting, retries and a circuit breaker around a question provider"""
+import random
+import threading
+import time
+
+import metrics
+import settings
+from providers import ProviderError, QuestionProvider
+from shared import SharedTokenBucket, open_state
+
+
+class CircuitOpenError(ProviderError):
+    """The provider is failing and calls are being short-circuited"""
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average with bursts of up to ``burst``"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to ``timeout`` seconds; returns False if none became available"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures and lets one trial call through after ``reset_timeout``.
+
+    Each time it opens, ``adaptive_breaker_trips_total{name=<name>}`` goes up by one.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold=5, reset_timeout=30.0, name='provider'):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.trips = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def release(self):
+        """Give up a trial call that ended without an outcome, so the next call can be the trial"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            tripped = self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.threshold)
+            if tripped:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.trips += 1
+        if tripped:
+            metrics.inc('adaptive_breaker_trips_total', self.name)
+
+
+class ResilientProvider(QuestionProvider):
+    """Wraps a provider with a rate limit, jittered exponential backoff and a circuit breaker.
+
+    When retries run out or the breaker is open, a test structure is built
+    from the topics stored in ``fallback`` (a QuestionBank) if it has any.
+    Question calls raise ProviderError: the caller knows the student and
+    draws unseen questions from the bank itself.
+    """
+
+    def __init__(self, provider, bucket, breaker, max_retries=3, base_delay=0.5, max_delay=8.0,
+                 rate_limit_timeout=10.0, fallback=None):
+        self.provider = provider
+        self.name = provider.name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_timeout = rate_limit_timeout
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'failures': 0, 'retries': 0, 'rate_limited': 0,
+                      'short_circuited': 0, 'fallback_serves': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+        metrics.inc('adaptive_provider_events_total', key)
+
+    def _backoff(self, attempt):
+        """Full jitter: a random wait up to the exponential delay for this attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise CircuitOpenError("Question provider is unavailable")
+        if not self.bucket.acquire(self.rate_limit_timeout):
+            # The call never reached the provider, so it says nothing about its health
+            self.breaker.release()
+            self._count('rate_limited')
+            raise ProviderError("Rate limit wait timed out")
+
+    def _call(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            self._admit()
+            self._count('calls')
+            try:
+                result = fn(*args)
+            except Exception:
+                self._count('failures')
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                self._count('retries')
+                time.sleep(self._backoff(attempt))
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def generate_structure(self, subject):
+        try:
+            return self._call(self.provider.generate_structure, subject)
+        except Exception:
+            topics = self.fallback.topics(subject) if self.fallback is not None else []
+            if not topics:
+                raise
+            self._count('fallback_serves')
+            return {'topics': topics}
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        return self._call(self.provider.generate_questions, subject, topic, subtopics, level, count)
+
+    def stream_question(self, subject, topic, subtopics, level):
+        """Stream without retries (chunks may already be on screen)"""
+        started = False
+        self._admit()
+        self._count('calls')
+        try:
+            for chunk in self.provider.stream_question(subject, topic, subtopics, level):
+                started = True
+                yield chunk
+        except Exception:
+            self._count('failures')
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Closed by the consumer (GeneratorExit): chunks arriving counts as a success
+            if started:
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+            raise
+        self.breaker.record_success()
+
+
+def wrap_provider(provider, fallback=None, name=None):
+    """``provider`` behind the rate limit, retries and breaker configured in settings (unless disabled).
+
+    With ADAPTIVE_SHARED_STATE_PATH the rate limit, named ``name`` (default
+    the provider's), is shared by every process using that file.
+    """
+    if not settings.RESILIENCE_ENABLED:
+        return provider
+    name = name or provider.name
+    if settings.SHARED_STATE_PATH:
+        bucket = SharedTokenBucket(open_state(settings.SHARED_STATE_PATH), f"rate:{name}",
+                                   settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST)
+    else:
+        bucket = TokenBucket(settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST)
+    return ResilientProvider(
+        provider,
+        bucket,
+        CircuitBreaker(settings.BREAKER_THRESHOLD, settings.BREAKER_RESET_SECONDS, name=name),
+        max_retries=settings.RETRY_MAX,
+        base_delay=settings.RETRY_BASE_DELAY,
+        max_delay=settings.RETRY_MAX_DELAY,
+        fallback=fallback,
+    )
@@ -0,0 +1,239 @@
+"""Per-request model routing with latency SLOs and token/latency budgets.
+
+Each request is routed by kind and level (``structure``, ``easy``,
+``medium``, ``hard``) to a named route, usually a cheaper fast model and a
+stronger one. Requests go to the fast route instead when:
+
+- the chosen route's latency (an EWMA) is over its SLO, for ``cooldown`` seconds;
+- the chosen route fails (its circuit breaker is open, retries ran out);
+- the session has spent its token or model-latency budget.
+
+Once the hourly token budget is spent, every call raises
+BudgetExceededError so the app serves from the question bank. The budget
+is per process unless ADAPTIVE_SHARED_STATE_PATH shares it between workers.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+
+import metrics
+import settings
+from providers import ProviderError, QuestionProvider, take_usage
+from resilience import wrap_provider
+from shared import SharedTokenBudget, open_state
+
+
+class BudgetExceededError(ProviderError):
+    """The process-wide token budget for the current hour is spent"""
+
+
+class SessionBudget:
+    """Tokens and model seconds one session may spend before it is routed to the fast model"""
+
+    def __init__(self, max_tokens=0, max_seconds=0.0):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.tokens = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def charge(self, tokens, seconds):
+        with self._lock:
+            self.tokens += tokens
+            self.seconds += seconds
+
+    @property
+    def exhausted(self):
+        return ((self.max_tokens and self.tokens >= self.max_tokens)
+                or (self.max_seconds and self.seconds >= self.max_seconds))
+
+
+class HourlyTokenBudget:
+    """Tokens spent by this process over the last hour, against a limit (0 means unlimited)"""
+
+    def __init__(self, limit, window=3600.0):
+        self.limit = limit
+        self.window = window
+        self._spent = deque()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._spent and self._spent[0][0] <= now - self.window:
+            self._total -= self._spent.popleft()[1]
+
+    def charge(self, tokens):
+        if tokens:
+            with self._lock:
+                self._spent.append((time.monotonic(), tokens))
+                self._total += tokens
+
+    def spent(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._total
+
+    @property
+    def exhausted(self):
+        return bool(self.limit) and self.spent() >= self.limit
+
+
+class RouteHealth:
+    """EWMA latency of one route; over the SLO it is skipped for ``cooldown`` seconds, then tried again"""
+
+    def __init__(self, slo, cooldown=60.0, alpha=0.3):
+        self.slo = slo
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.latency = None
+        self.degradations = 0
+        self._degraded_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+            if self.slo and self.latency > self.slo and time.monotonic() >= self._degraded_until:
+                self._degraded_until = time.monotonic() + self.cooldown
+                # Start the next trial from the SLO rather than the slow average
+                self.latency = self.slo
+                self.degradations += 1
+
+    @property
+    def degraded(self):
+        return time.monotonic() < self._degraded_until
+
+
+# The budget of the session whose script (or prefetch work) is running in this context
+_session_budget = contextvars.ContextVar('adaptive_session_budget', default=None)
+
+
+def set_session_budget(budget):
+    _session_budget.set(budget)
+
+
+class ModelRouter(QuestionProvider):
+    """Sends each request to a route from ``table`` (kind or level -> route name) over ``routes``"""
+
+    name = 'router'
+
+    def __init__(self, routes, table, fast_route, slos=None, cooldown=60.0, hourly_tokens=0, budget=None):
+        self.routes = routes
+        self.table = table
+        self.fast_route = fast_route
+        self.health = {name: RouteHealth((slos or {}).get(name, 0.0), cooldown) for name in routes}
+        self.budget = budget or HourlyTokenBudget(hourly_tokens)
+        self._lock = threading.Lock()
+        self.stats = {'degraded_slo': 0, 'degraded_budget': 0, 'degraded_failure': 0, 'budget_exceeded': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+        metrics.inc('adaptive_router_events_total', key)
+
+    def route_for(self, kind):
+        """The route a request of ``kind`` would use right now"""
+        route = self.table.get(kind, self.fast_route)
+        if route == self.fast_route:
+            return route
+        budget = _session_budget.get()
+        if budget is not None and budget.exhausted:
+            self._count('degraded_budget')
+            return self.fast_route
+        if self.health[route].degraded:
+            self._count('degraded_slo')
+            return self.fast_route
+        return route
+
+    def _admit(self):
+        if self.budget.exhausted:
+            self._count('budget_exceeded')
+            raise BudgetExceededError("Hourly model token budget is spent")
+
+    def _charge(self, route, seconds):
+        tokens = take_usage()
+        self.health[route].record(seconds)
+        self.budget.charge(tokens)
+        budget = _session_budget.get()
+        if budget is not None:
+            budget.charge(tokens, seconds)
+        metrics.observe('adaptive_route_seconds', route, seconds)
+        metrics.inc('adaptive_route_tokens_total', route, tokens)
+
+    def _call(self, kind, method, *args):
+        self._admit()
+        route = self.route_for(kind)
+        try:
+            return self._call_route(route, method, *args)
+        except BudgetExceededError:
+            raise
+        except Exception:
+            if route == self.fast_route:
+                raise
+            self._count('degraded_failure')
+            return self._call_route(self.fast_route, method, *args)
+
+    def _call_route(self, route, method, *args):
+        metrics.inc('adaptive_route_calls_total', route)
+        take_usage()
+        start = time.perf_counter()
+        try:
+            return getattr(self.routes[route], method)(*args)
+        finally:
+            self._charge(route, time.perf_counter() - start)
+
+    def generate_structure(self, subject):
+        return self._call('structure', 'generate_structure', subject)
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        return self._call(level, 'generate_questions', subject, topic, subtopics, level, count)
+
+    def stream_question(self, subject, topic, subtopics, level):
+        """Stream from the routed model; a stream that fails before its first chunk is retried on the fast route"""
+        self._admit()
+        route = self.route_for(level)
+        started = False
+        try:
+            for chunk in self._stream_route(route, subject, topic, subtopics, level):
+                started = True
+                yield chunk
+        except BudgetExceededError:
+            raise
+        except Exception:
+            if started or route == self.fast_route:
+                raise
+            self._count('degraded_failure')
+            yield from self._stream_route(self.fast_route, subject, topic, subtopics, level)
+
+    def _stream_route(self, route, subject, topic, subtopics, level):
+        metrics.inc('adaptive_route_calls_total', route)
+        take_usage()
+        start = time.perf_counter()
+        try:
+            yield from self.routes[route].stream_question(subject, topic, subtopics, level)
+        finally:
+            self._charge(route, time.perf_counter() - start)
+
+
+def route_models(models, fallback=None):
+    """A router over ``{'fast': provider, 'strong': provider}`` configured from settings, each
+    route behind its own rate limit and breaker; just the strong model if routing is off.
+
+    Entries of ADAPTIVE_ROUTES naming a route that is not in ``models`` are
+    ignored, so those kinds go to the fast route.
+    """
+    if not settings.ROUTER_ENABLED:
+        return wrap_provider(models['strong'], fallback=fallback, name='strong')
+    budget = None
+    if settings.SHARED_STATE_PATH:
+        budget = SharedTokenBudget(open_state(settings.SHARED_STATE_PATH), 'tokens', settings.HOURLY_TOKEN_BUDGET)
+    return ModelRouter(
+        {route: wrap_provider(model, fallback=fallback, name=route) for route, model in models.items()},
+        {kind: route for kind, route in settings.ROUTES.items() if route in models},
+        fast_route='fast',
+        slos=settings.ROUTE_SLO_SECONDS,
+        cooldown=settings.ROUTE_COOLDOWN_SECONDS,
+        hourly_tokens=settings.HOURLY_TOKEN_BUDGET,
+        budget=budget,
+    )
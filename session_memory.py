@@ -0,0 +1,128 @@
+"""Bounded per-session question storage and per-session memory accounting.
+
+A session used to hold every question it served for the whole test.
+``QuestionWindow`` keeps only the last few, which is all the test page
+reads; everything earlier is in the checkpoint store. ``INTERNED`` holds one
+shared copy of each bank question per process, so the sessions and
+prefetch pools that draw the same question do not keep their own copies.
+``footprint()`` reports how much memory a session's state holds.
+"""
+import sys
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Executor
+from types import FunctionType, MethodType, ModuleType
+
+import numpy as np
+
+
+class SharedQuestion(dict):
+    """A bank question held once per process; weakly referenced so it is freed with its last session"""
+
+    __slots__ = ('__weakref__',)
+
+
+class QuestionInterner:
+    """Canonical ``SharedQuestion`` per ``bank_id``, for as long as some session or pool refers to it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._questions = weakref.WeakValueDictionary()
+        self.stats = {'interned': 0, 'reused': 0}
+
+    def __len__(self):
+        return len(self._questions)
+
+    def intern(self, question):
+        """The shared copy of ``question``; questions without a ``bank_id`` are returned as they are"""
+        bank_id = question.get('bank_id')
+        if bank_id is None:
+            return question
+        with self._lock:
+            shared = self._questions.get(bank_id)
+            if shared is not None:
+                self.stats['reused'] += 1
+                return shared
+            shared = self._questions[bank_id] = SharedQuestion(question)
+            self.stats['interned'] += 1
+            return shared
+
+
+INTERNED = QuestionInterner()
+
+
+class QuestionWindow:
+    """Questions served in one test, indexed from 0; only the last ``keep`` are held (all if ``keep`` is 0)"""
+
+    __slots__ = ('keep', 'start', '_questions')
+
+    def __init__(self, keep=0, questions=()):
+        self.keep = keep
+        self.start = 0
+        self._questions = deque()
+        for question in questions:
+            self.append(question)
+
+    def __len__(self):
+        return self.start + len(self._questions)
+
+    def __getitem__(self, idx):
+        if not self.start <= idx < len(self):
+            raise IndexError(f"question {idx} is not held (window starts at {self.start})")
+        return self._questions[idx - self.start]
+
+    def append(self, question):
+        self._questions.append(question)
+        if self.keep and len(self._questions) > self.keep:
+            self._questions.popleft()
+            self.start += 1
+
+    def items(self):
+        """``(index, question)`` for the questions still held"""
+        return enumerate(self._questions, self.start)
+
+
+# Not walked by footprint(): code, threads and synchronization, not session data
+_OPAQUE = (type, ModuleType, FunctionType, MethodType, threading.Thread, Executor)
+
+
+def _deep_size(obj, seen, shared):
+    """Bytes reachable from ``obj`` not already in ``seen``; ``SharedQuestion`` bytes go to ``shared[0]``"""
+    if id(obj) in seen or isinstance(obj, _OPAQUE) or type(obj).__module__ in ('threading', '_thread'):
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, SharedQuestion):
+        shared[0] += _deep_size(dict(obj), seen, shared)
+        return 0
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        return size if obj.base is None else size + obj.nbytes
+    if isinstance(obj, dict):
+        children = [item for pair in obj.items() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        children = obj
+    elif isinstance(obj, (str, bytes, int, float, complex, bool)) or obj is None:
+        return size
+    else:
+        children = list(getattr(obj, '__dict__', {}).values())
+        for cls in type(obj).__mro__:
+            slots = getattr(cls, '__slots__', ())
+            children.extend(getattr(obj, name) for name in ((slots,) if isinstance(slots, str) else slots)
+                            if name not in ('__weakref__', '__dict__') and hasattr(obj, name))
+    return size + sum(_deep_size(child, seen, shared) for child in children)
+
+
+def footprint(state):
+    """``{key: (own bytes, shared bytes)}`` for a session's state.
+
+    Own bytes are held by this session alone, as far as the walk can tell:
+    an object reached from two keys is counted under the first.
+    Shared bytes are interned questions, which other sessions may also hold.
+    """
+    seen = set()
+    report = {}
+    for key, value in state.items():
+        shared = [0]
+        report[key] = (_deep_size(value, seen, shared), shared[0])
+    return report
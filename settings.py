@@ -0,0 +1,134 @@
+"""Runtime settings read from ADAPTIVE_* environment variables"""
+import os
+
+
+def _to_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _mapping(cast=str):
+    """Cast for ``key=value,key=value`` settings; a malformed pair raises ValueError"""
+    def parse(value):
+        result = {}
+        for pair in value.split(','):
+            key, sep, item = pair.partition('=')
+            if not sep or not key.strip():
+                raise ValueError(f"Expected key=value, got {pair!r}")
+            result[key.strip()] = cast(item.strip())
+        return result
+    return parse
+
+
+def env_setting(name, default, cast=str):
+    """Read an environment variable, falling back to the default when unset or invalid"""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    if cast is bool:
+        cast = _to_bool
+    try:
+        return cast(value)
+    except ValueError:
+        return default
+
+
+# Background prefetch of the next question
+PREFETCH_ENABLED = env_setting('ADAPTIVE_PREFETCH', True, bool)
+PREFETCH_MAX_INFLIGHT = env_setting('ADAPTIVE_PREFETCH_MAX_INFLIGHT', 2, int)
+
+# Batched generation: questions requested per model call and the per-session pool
+QUESTION_BATCH_SIZE = env_setting('ADAPTIVE_QUESTION_BATCH_SIZE', 5, int)
+POOL_LOW_WATER = env_setting('ADAPTIVE_POOL_LOW_WATER', 2, int)
+POOL_MAX_PER_STATE = env_setting('ADAPTIVE_POOL_MAX_PER_STATE', 20, int)
+
+# Persistent question bank, read before calling the model
+BANK_ENABLED = env_setting('ADAPTIVE_BANK', True, bool)
+BANK_PATH = env_setting('ADAPTIVE_BANK_PATH', 'question_bank.db')
+BANK_RATIO = env_setting('ADAPTIVE_BANK_RATIO', 0.8, float)
+
+# Test structure cache, shared across sessions and worker processes
+STRUCTURE_CACHE_SHARED = env_setting('ADAPTIVE_STRUCTURE_CACHE_SHARED', True, bool)
+STRUCTURE_CACHE_PATH = env_setting('ADAPTIVE_STRUCTURE_CACHE_PATH', 'structure_cache.db')
+STRUCTURE_CACHE_TTL = env_setting('ADAPTIVE_STRUCTURE_CACHE_TTL', 86400, int)
+STRUCTURE_CACHE_SIZE = env_setting('ADAPTIVE_STRUCTURE_CACHE_SIZE', 64, int)
+
+# Question provider: gemini, bank (question bank only) or fake (offline stand-in)
+PROVIDER = env_setting('ADAPTIVE_PROVIDER', 'gemini').strip().lower()
+FAKE_LATENCY = env_setting('ADAPTIVE_FAKE_LATENCY', 0.0, float)
+FAKE_FAILURE_RATE = env_setting('ADAPTIVE_FAKE_FAILURE_RATE', 0.0, float)
+FAKE_SEED = env_setting('ADAPTIVE_FAKE_SEED', 0, int)
+
+# Computerized adaptive testing (IRT) mode
+CAT_SE_THRESHOLD = env_setting('ADAPTIVE_CAT_SE_THRESHOLD', 0.5, float)
+CAT_MIN_PER_TOPIC = env_setting('ADAPTIVE_CAT_MIN_PER_TOPIC', 2, int)
+CAT_MAX_PER_TOPIC = env_setting('ADAPTIVE_CAT_MAX_PER_TOPIC', 8, int)
+
+# How often the countdown fragment refreshes, in seconds
+TIMER_REFRESH_SECONDS = env_setting('ADAPTIVE_TIMER_REFRESH_SECONDS', 1.0, float)
+
+# Stream a question into the page when none is pooled
+STREAMING_ENABLED = env_setting('ADAPTIVE_STREAMING', True, bool)
+# Longest an answer waits for the rest of a streamed question (its explanation), in seconds
+STREAM_FINISH_TIMEOUT = env_setting('ADAPTIVE_STREAM_FINISH_TIMEOUT', 15.0, float)
+
+# Model client resilience: per-process rate limit, retries and circuit breaker
+RESILIENCE_ENABLED = env_setting('ADAPTIVE_RESILIENCE', True, bool)
+RATE_LIMIT_PER_SECOND = env_setting('ADAPTIVE_RATE_LIMIT_PER_SECOND', 5.0, float)
+RATE_LIMIT_BURST = env_setting('ADAPTIVE_RATE_LIMIT_BURST', 10, int)
+RETRY_MAX = env_setting('ADAPTIVE_RETRY_MAX', 3, int)
+RETRY_BASE_DELAY = env_setting('ADAPTIVE_RETRY_BASE_DELAY', 0.5, float)
+RETRY_MAX_DELAY = env_setting('ADAPTIVE_RETRY_MAX_DELAY', 8.0, float)
+BREAKER_THRESHOLD = env_setting('ADAPTIVE_BREAKER_THRESHOLD', 5, int)
+BREAKER_RESET_SECONDS = env_setting('ADAPTIVE_BREAKER_RESET_SECONDS', 30.0, float)
+
+# Instrumentation: timing spans and model-call metrics, exported as Prometheus text
+METRICS_ENABLED = env_setting('ADAPTIVE_METRICS', True, bool)
+METRICS_FILE = env_setting('ADAPTIVE_METRICS_FILE', None)
+METRICS_FILE_INTERVAL = env_setting('ADAPTIVE_METRICS_FILE_INTERVAL', 15.0, float)
+METRICS_PORT = env_setting('ADAPTIVE_METRICS_PORT', 0, int)
+TRACE_ENABLED = env_setting('ADAPTIVE_TRACE', False, bool)
+ADMIN_USERS = [u.strip() for u in env_setting('ADAPTIVE_ADMIN_USERS', '').split(',') if u.strip()]
+
+# Durable checkpoints of in-progress tests, resumed on the next login
+CHECKPOINT_ENABLED = env_setting('ADAPTIVE_CHECKPOINTS', True, bool)
+CHECKPOINT_PATH = env_setting('ADAPTIVE_CHECKPOINT_PATH', 'checkpoints.db')
+
+# Append-only attempt/answer store for analysis after an exam
+ATTEMPTS_ENABLED = env_setting('ADAPTIVE_ATTEMPTS', True, bool)
+ATTEMPTS_PATH = env_setting('ADAPTIVE_ATTEMPTS_PATH', 'attempts.db')
+ATTEMPTS_BATCH_SIZE = env_setting('ADAPTIVE_ATTEMPTS_BATCH_SIZE', 200, int)
+ATTEMPTS_FLUSH_SECONDS = env_setting('ADAPTIVE_ATTEMPTS_FLUSH_SECONDS', 2.0, float)
+
+# Users who can open the instructor dashboard (admins always can)
+INSTRUCTOR_USERS = [u.strip() for u in env_setting('ADAPTIVE_INSTRUCTOR_USERS', '').split(',') if u.strip()]
+
+# Near-duplicate questions: MinHash similarity at or above the threshold counts as a repeat
+DEDUP_ENABLED = env_setting('ADAPTIVE_DEDUP', True, bool)
+DEDUP_THRESHOLD = env_setting('ADAPTIVE_DEDUP_THRESHOLD', 0.7, float)
+DEDUP_MAX_REPLACEMENTS = env_setting('ADAPTIVE_DEDUP_MAX_REPLACEMENTS', 3, int)
+
+# Model routing: route per request kind/level, latency SLOs (seconds) per route, and spend budgets
+ROUTER_ENABLED = env_setting('ADAPTIVE_ROUTER', True, bool)
+MODEL_FAST = env_setting('ADAPTIVE_MODEL_FAST', 'gemini-2.5-flash-lite')
+MODEL_STRONG = env_setting('ADAPTIVE_MODEL_STRONG', 'gemini-2.5-flash')
+ROUTES = env_setting('ADAPTIVE_ROUTES', {'structure': 'strong', 'easy': 'fast', 'medium': 'strong', 'hard': 'strong'},
+                     _mapping())
+ROUTE_SLO_SECONDS = env_setting('ADAPTIVE_ROUTE_SLO', {'strong': 8.0, 'fast': 4.0}, _mapping(float))
+ROUTE_COOLDOWN_SECONDS = env_setting('ADAPTIVE_ROUTE_COOLDOWN_SECONDS', 60.0, float)
+SESSION_TOKEN_BUDGET = env_setting('ADAPTIVE_SESSION_TOKEN_BUDGET', 100000, int)
+SESSION_LATENCY_BUDGET = env_setting('ADAPTIVE_SESSION_LATENCY_BUDGET', 600.0, float)
+HOURLY_TOKEN_BUDGET = env_setting('ADAPTIVE_HOURLY_TOKEN_BUDGET', 0, int)
+
+# Users, enrolments and signed session tokens (a reconnect or another worker resumes the login)
+USERS_PATH = env_setting('ADAPTIVE_USERS_PATH', 'users.db')
+USERS_SEED_DEMO = env_setting('ADAPTIVE_USERS_SEED_DEMO', True, bool)
+PASSWORD_ITERATIONS = env_setting('ADAPTIVE_PASSWORD_ITERATIONS', 200000, int)
+SESSION_SECRET = env_setting('ADAPTIVE_SESSION_SECRET', None)
+SESSION_TTL_SECONDS = env_setting('ADAPTIVE_SESSION_TTL_SECONDS', 43200, int)
+
+# Horizontal deployment: model rate limits and the hourly token budget shared by every
+# worker through this SQLite file (unset keeps them per process); see cluster.py
+SHARED_STATE_PATH = env_setting('ADAPTIVE_SHARED_STATE_PATH', None)
+
+# Per-session memory: how many of the latest served questions a session holds (0 keeps all)
+SESSION_QUESTION_WINDOW = env_setting('ADAPTIVE_SESSION_QUESTION_WINDOW', 3, int)
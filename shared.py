@@ -0,0 +1,137 @@
+"""Rate limits and token budgets shared by every app process through one SQLite file.
+
+With several workers behind a load balancer, a per-process rate limit or
+hourly token budget lets N workers spend N times the model quota.
+``SharedTokenBucket`` and ``SharedTokenBudget`` keep that state in the
+file named by ADAPTIVE_SHARED_STATE_PATH and change it in short
+``BEGIN IMMEDIATE`` transactions; they have the interface of the
+in-process ``TokenBucket`` and ``HourlyTokenBudget``. Times are wall-clock
+so that processes agree on them.
+"""
+import functools
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS spend (
+    name TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (name, minute)
+) WITHOUT ROWID;
+"""
+
+
+class SharedState:
+    """Named token buckets and per-minute spend counters in one SQLite database"""
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, name, rate, burst):
+        """Take one token from bucket ``name``; returns 0 if taken, else the seconds until one is due"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE name = ?', (name,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                         (name, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def charge(self, name, amount, keep=3600):
+        """Add ``amount`` to this minute's counter for ``name``, dropping minutes older than ``keep`` seconds"""
+        minute = int(time.time() // 60)
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT INTO spend (name, minute, amount) VALUES (?, ?, ?) '
+                         'ON CONFLICT (name, minute) DO UPDATE SET amount = amount + excluded.amount',
+                         (name, minute, amount))
+            conn.execute('DELETE FROM spend WHERE name = ? AND minute < ?', (name, minute - keep // 60))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def spent(self, name, window=3600):
+        """Total charged to ``name`` over the last ``window`` seconds, to the minute"""
+        since = int((time.time() - window) // 60) + 1
+        row = self._conn().execute('SELECT SUM(amount) FROM spend WHERE name = ? AND minute >= ?',
+                                   (name, since)).fetchone()
+        return row[0] or 0
+
+
+@functools.lru_cache(maxsize=None)
+def open_state(path):
+    """The process-wide SharedState for ``path``"""
+    return SharedState(path)
+
+
+class SharedTokenBucket:
+    """A TokenBucket whose tokens are shared by every process using the same state and name"""
+
+    def __init__(self, state, name, rate, burst):
+        self.state = state
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to ``timeout`` seconds; returns False if none became available"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.state.take(self.name, self.rate, self.burst)
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class SharedTokenBudget:
+    """An HourlyTokenBudget counted across every process using the same state and name"""
+
+    def __init__(self, state, name, limit, window=3600):
+        self.state = state
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def charge(self, tokens):
+        if tokens:
+            self.state.charge(self.name, tokens, self.window)
+
+    def spent(self):
+        return self.state.spent(self.name, self.window)
+
+    @property
+    def exhausted(self):
+        return bool(self.limit) and self.spent() >= self.limit
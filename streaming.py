@@ -0,0 +1,112 @@
+"""Incremental parsing of a streamed single-question JSON response"""
+import json
+
+
+class QuestionStreamParser:
+    """Pulls fields out of a question object while its JSON is still arriving.
+
+    ``feed(text)`` returns the events completed by that chunk, in order:
+    ``('question', str)``, ``('option', index, str)``, ``('correctAnswer', int)``
+    and ``('explanation', str)``. Anything before the first ``{`` (such as a
+    markdown fence) is skipped, and only top-level keys are reported.
+    """
+
+    def __init__(self):
+        self.fields = {'options': []}
+        self._started = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer = []
+        self._key = None
+        self._expect_key = True
+        self._scalar = []
+        self._options_closed = False
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def ready(self):
+        """True once the stem, the complete option list and the correct answer are known"""
+        return (bool(self.fields.get('question')) and self._options_closed
+                and 'correctAnswer' in self.fields)
+
+    def feed(self, text):
+        events = []
+        for ch in text:
+            if self._done:
+                break
+            if not self._started:
+                if ch == '{':
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                self._string_char(ch, events)
+            elif ch == '"':
+                self._in_string = True
+                self._buffer = []
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._end_scalar(events)
+                if self._depth == 2 and self._key == 'options':
+                    self._options_closed = True
+                self._depth -= 1
+                if self._depth == 0:
+                    self._done = True
+            elif ch == ':':
+                self._expect_key = False
+            elif ch == ',':
+                self._end_scalar(events)
+                if self._depth == 1:
+                    self._expect_key = True
+            elif not ch.isspace() and self._depth == 1 and not self._expect_key:
+                self._scalar.append(ch)
+        return events
+
+    def _string_char(self, ch, events):
+        if self._escape:
+            self._escape = False
+            self._buffer.append(ch)
+        elif ch == '\\':
+            self._escape = True
+            self._buffer.append(ch)
+        elif ch == '"':
+            self._in_string = False
+            value = json.loads('"' + ''.join(self._buffer) + '"')
+            self._string_done(value, events)
+        else:
+            self._buffer.append(ch)
+
+    def _string_done(self, value, events):
+        if self._depth == 1 and self._expect_key:
+            self._key = value
+        elif self._depth == 1:
+            self.fields[self._key] = value
+            if self._key in ('question', 'explanation'):
+                events.append((self._key, value))
+            elif self._key == 'correctAnswer':
+                self._set_correct(value, events)
+        elif self._depth == 2 and self._key == 'options':
+            self.fields['options'].append(value)
+            events.append(('option', len(self.fields['options']) - 1, value))
+
+    def _end_scalar(self, events):
+        if not self._scalar:
+            return
+        raw = ''.join(self._scalar)
+        self._scalar = []
+        if self._key == 'correctAnswer':
+            self._set_correct(raw, events)
+
+    def _set_correct(self, raw, events):
+        try:
+            value = int(raw)
+        except ValueError:
+            return
+        self.fields['correctAnswer'] = value
+        events.append(('correctAnswer', value))
@@ -0,0 +1,211 @@
+"""Test-structure cache shared by sessions and worker processes, with single-flight loading"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS structures (
+    subject TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    expires_at REAL,
+    pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS structure_leases (
+    subject TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class StructureCache:
+    """Structures keyed by subject, with TTL and LRU eviction.
+
+    Concurrent ``get()`` calls for the same subject in one process wait on a
+    single ``loader`` call. With a ``path`` the cache is also backed by a
+    SQLite table, and a short lease row makes other processes wait for the
+    first one's result instead of calling the model themselves. Local copies
+    of shared entries are re-read from the table after ``recheck`` seconds,
+    so a refresh or pin in one process reaches the others. Pinned subjects
+    never expire and are not evicted.
+    """
+
+    def __init__(self, path=None, ttl=86400, max_entries=64, lease_timeout=60, poll_interval=0.2, recheck=5.0):
+        self.path = path
+        self._ttl = ttl
+        self._max_entries = max(1, max_entries)
+        self._lease_timeout = lease_timeout
+        self._poll_interval = poll_interval
+        self._recheck = recheck if path else float('inf')
+        self._owner = f"{os.getpid()}-{id(self)}"
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._local = threading.local()
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+        if path:
+            conn = self._conn()
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, subject, loader):
+        """Return the structure for ``subject``, calling ``loader(subject)`` at most once per miss"""
+        with self._lock:
+            structure = self._get_local(subject)
+            if structure is not None:
+                self.stats['hits'] += 1
+                return structure
+            future = self._inflight.get(subject)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[subject] = future
+            else:
+                self.stats['coalesced'] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            structure = self._load(subject, loader)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(structure)
+            return structure
+        finally:
+            with self._lock:
+                self._inflight.pop(subject, None)
+
+    def pin(self, subject, structure):
+        """Keep ``structure`` for ``subject`` until unpinned or refreshed"""
+        self._put(subject, structure, pinned=True)
+
+    def unpin(self, subject):
+        """Let a pinned structure expire normally again"""
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is not None:
+                self._entries[subject] = (entry[0], time.time() + self._ttl, False, entry[3])
+        if self.path:
+            self._conn().execute('UPDATE structures SET pinned = 0, expires_at = ? WHERE subject = ?',
+                                 (time.time() + self._ttl, subject))
+
+    def refresh(self, subject, loader):
+        """Drop the cached structure for ``subject`` (even if pinned) and load a new one"""
+        self.invalidate(subject)
+        return self.get(subject, loader)
+
+    def invalidate(self, subject):
+        with self._lock:
+            self._entries.pop(subject, None)
+        if self.path:
+            self._conn().execute('DELETE FROM structures WHERE subject = ?', (subject,))
+
+    def _get_local(self, subject):
+        entry = self._entries.get(subject)
+        if entry is None:
+            return None
+        structure, expires_at, pinned, recheck_at = entry
+        now = time.time()
+        # Past recheck_at, the shared table (which another process may have refreshed) has the say
+        if (not pinned and expires_at <= now) or recheck_at <= now:
+            del self._entries[subject]
+            return None
+        self._entries.move_to_end(subject)
+        return structure
+
+    def _remember(self, subject, structure, expires_at, pinned):
+        with self._lock:
+            self._entries[subject] = (structure, expires_at, pinned, time.time() + self._recheck)
+            self._entries.move_to_end(subject)
+            for key in list(self._entries):
+                if len(self._entries) <= self._max_entries:
+                    break
+                if not self._entries[key][2]:
+                    del self._entries[key]
+                    self.stats['evictions'] += 1
+
+    def _put(self, subject, structure, pinned=False):
+        expires_at = time.time() + self._ttl
+        self._remember(subject, structure, expires_at, pinned)
+        if self.path:
+            self._conn().execute(
+                'INSERT OR REPLACE INTO structures (subject, payload, expires_at, pinned) VALUES (?, ?, ?, ?)',
+                (subject, json.dumps(structure), None if pinned else expires_at, int(pinned)))
+
+    def _get_shared(self, subject):
+        row = self._conn().execute('SELECT payload, expires_at, pinned FROM structures WHERE subject = ?',
+                                   (subject,)).fetchone()
+        if row is None:
+            return None
+        payload, expires_at, pinned = row
+        if not pinned and expires_at <= time.time():
+            return None
+        structure = json.loads(payload)
+        self._remember(subject, structure, expires_at or time.time() + self._ttl, bool(pinned))
+        return structure
+
+    def _acquire_lease(self, subject):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM structure_leases WHERE subject = ? AND expires_at <= ?', (subject, now))
+            cur = conn.execute('INSERT OR IGNORE INTO structure_leases (subject, owner, expires_at) VALUES (?, ?, ?)',
+                               (subject, self._owner, now + self._lease_timeout))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return cur.rowcount == 1
+
+    def _release_lease(self, subject):
+        self._conn().execute('DELETE FROM structure_leases WHERE subject = ? AND owner = ?', (subject, self._owner))
+
+    def _load(self, subject, loader):
+        if not self.path:
+            with self._lock:
+                self.stats['misses'] += 1
+            structure = loader(subject)
+            self._put(subject, structure)
+            return structure
+
+        deadline = time.time() + self._lease_timeout
+        while True:
+            structure = self._get_shared(subject)
+            if structure is not None:
+                with self._lock:
+                    self.stats['shared_hits'] += 1
+                return structure
+            if self._acquire_lease(subject) or time.time() >= deadline:
+                break
+            # Another process is loading this subject
+            time.sleep(self._poll_interval)
+
+        try:
+            # The previous lease holder may have finished just before we took over
+            structure = self._get_shared(subject)
+            if structure is not None:
+                with self._lock:
+                    self.stats['shared_hits'] += 1
+                return structure
+            with self._lock:
+                self.stats['misses'] += 1
+            structure = loader(subject)
+            self._put(subject, structure)
+            return structure
+        finally:
+            self._release_lease(subject)
@@ -0,0 +1,18 @@
+"""Subjects offered by the app, shared by the pages and offline tools"""
+
+# Subject structure based on semester
+SUBJECTS_BY_SEMESTER = {
+    3: ['C Programming', 'Data Structures', 'Database Management', 'Computer Networks'],
+    5: ['Operating Systems', 'Compiler Design', 'Machine Learning', 'Web Technologies']
+}
+
+INTERVIEW_PREP = ['C Programming', 'Data Structures', 'Algorithms', 'DBMS', 'Operating Systems', 'Computer Networks']
+
+
+def all_subjects():
+    """Every subject once, semester subjects first"""
+    subjects = []
+    for subject in [s for semester in SUBJECTS_BY_SEMESTER.values() for s in semester] + INTERVIEW_PREP:
+        if subject not in subjects:
+            subjects.append(subject)
+    return subjects
@@ -0,0 +1,22 @@
+from concurrent.futures import Future
+
+from prefetch import QuestionPrefetcher
+
+
+def test_take_uses_a_finished_refill_before_its_callback_runs():
+    prefetcher = QuestionPrefetcher(lambda: [])
+    future = Future()
+    future.set_result([{'question': 'q'}])
+    # Finished, but its done callback (which would move the questions into the pool) has not run
+    prefetcher._pending['state'] = future
+    assert prefetcher.take('state', timeout=1) == {'question': 'q'}
+    assert prefetcher.inflight() == 0
+    prefetcher.shutdown()
+
+
+def test_refill_is_pooled_once():
+    prefetcher = QuestionPrefetcher(lambda: [{'question': 'q'}])
+    prefetcher.prefetch([('state', ())])
+    assert prefetcher.take('state', timeout=5) == {'question': 'q'}
+    assert prefetcher.take('state', timeout=0) is None
+    prefetcher.shutdown()
@@ -0,0 +1,120 @@
+import pytest
+
+import metrics
+from providers import ProviderError, QuestionProvider
+from resilience import CircuitBreaker, CircuitOpenError, ResilientProvider
+
+
+class Bucket:
+    def __init__(self):
+        self.empty = False
+
+    def acquire(self, timeout=None):
+        return not self.empty
+
+
+class Provider(QuestionProvider):
+    name = 'stub'
+
+    def __init__(self):
+        self.failing = False
+
+    def generate_questions(self, subject, topic, subtopics, level, count):
+        if self.failing:
+            raise ProviderError("down")
+        return [{'question': 'q'}]
+
+    def stream_question(self, subject, topic, subtopics, level):
+        if self.failing:
+            raise ProviderError("down")
+        yield '{"question": '
+        yield '"q"}'
+
+
+class Bank:
+    draws = 0
+
+    def draw(self, subject, topic, level, username, limit):
+        self.draws += 1
+        return [{'question': 'banked'}]
+
+
+def tripped():
+    """A provider whose breaker has just opened and allows a trial call right away"""
+    provider, bucket = Provider(), Bucket()
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.0, name='stub')
+    resilient = ResilientProvider(provider, bucket, breaker, max_retries=0, rate_limit_timeout=0)
+    provider.failing = True
+    with pytest.raises(ProviderError):
+        resilient.generate_questions('s', 't', [], 'easy', 1)
+    provider.failing = False
+    assert breaker.state == CircuitBreaker.OPEN
+    return resilient, bucket, breaker
+
+
+def test_half_open_trial_success_closes():
+    resilient, _, breaker = tripped()
+    assert resilient.generate_questions('s', 't', [], 'easy', 1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_failure_reopens():
+    resilient, _, breaker = tripped()
+    resilient.provider.failing = True
+    with pytest.raises(ProviderError):
+        resilient.generate_questions('s', 't', [], 'easy', 1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+
+
+def test_rate_limited_trial_does_not_stick_half_open():
+    resilient, bucket, breaker = tripped()
+    bucket.empty = True
+    with pytest.raises(ProviderError) as raised:
+        resilient.generate_questions('s', 't', [], 'easy', 1)
+    assert not isinstance(raised.value, CircuitOpenError)
+    assert breaker.state == CircuitBreaker.OPEN
+    bucket.empty = False
+    assert resilient.generate_questions('s', 't', [], 'easy', 1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_stream_closed_after_first_chunk_counts_as_success():
+    resilient, _, breaker = tripped()
+    stream = resilient.stream_question('s', 't', [], 'easy')
+    next(stream)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    stream.close()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_stream_abandoned_without_chunks_releases_trial():
+    resilient, _, breaker = tripped()
+
+    def stalled(subject, topic, subtopics, level):
+        raise GeneratorExit
+        yield
+
+    resilient.provider.stream_question = stalled
+    with pytest.raises(GeneratorExit):
+        next(resilient.stream_question('s', 't', [], 'easy'))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+
+
+def test_trips_are_exported_as_a_metric():
+    before = metrics.REGISTRY.counters.get(('adaptive_breaker_trips_total', 'stub'), 0)
+    resilient, _, breaker = tripped()
+    assert breaker.name == 'stub'
+    assert metrics.REGISTRY.counters[('adaptive_breaker_trips_total', 'stub')] == before + 1
+
+
+def test_failed_questions_are_left_to_the_caller():
+    resilient, _, breaker = tripped()
+    resilient.fallback = Bank()
+    resilient.provider.failing = True
+    with pytest.raises(ProviderError):
+        resilient.generate_questions('s', 't', [], 'easy', 1)
+    with pytest.raises(ProviderError):
+        next(resilient.stream_question('s', 't', [], 'easy'))
+    assert resilient.fallback.draws == 0
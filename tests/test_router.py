@@ -0,0 +1,41 @@
+import threading
+
+from providers import add_usage
+from router import ModelRouter, SessionBudget, set_session_budget
+
+
+def in_new_thread(fn):
+    """Run ``fn`` on a new thread, as Streamlit runs fragment reruns and widget callbacks"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def make_router():
+    return ModelRouter({'fast': None, 'strong': None}, {'hard': 'strong'}, 'fast')
+
+
+def test_session_budget_is_not_inherited_by_new_threads():
+    router, budget = make_router(), SessionBudget(max_tokens=10)
+    budget.charge(10, 0.0)
+    set_session_budget(budget)
+    try:
+        assert router.route_for('hard') == 'fast'
+        assert in_new_thread(lambda: router.route_for('hard')) == 'strong'
+    finally:
+        set_session_budget(None)
+
+
+def test_session_budget_bound_in_new_thread_routes_and_charges():
+    router, budget = make_router(), SessionBudget(max_tokens=10)
+
+    def callback():
+        set_session_budget(budget)
+        add_usage(12)
+        router._charge('strong', 0.5)
+        return router.route_for('hard')
+
+    assert in_new_thread(callback) == 'fast'
+    assert (budget.tokens, budget.seconds) == (12, 0.5)
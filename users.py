@@ -0,0 +1,271 @@
+"""Students, their enrolments and signed session tokens, backed by SQLite.
+
+Passwords are stored as salted PBKDF2-SHA256 hashes with their iteration
+count, so the cost can be raised later; a login with an older count
+rehashes the password. A session token is ``<payload>.<signature>``: the
+username, the user's session version and an expiry, signed with HMAC. Any
+worker holding the same secret can check it with one primary-key lookup,
+and bumping the session version (on logout) revokes every token issued
+before. Run as a script to add or import students::
+
+    python users.py add student3 --name "Ada Lovelace" --semester 3
+    python users.py import students.csv
+"""
+import argparse
+import base64
+import csv
+import getpass
+import hashlib
+import hmac
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+from subjects import SUBJECTS_BY_SEMESTER
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    semester INTEGER NOT NULL,
+    password_hash TEXT NOT NULL,
+    session_version INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_semester ON users (semester);
+CREATE TABLE IF NOT EXISTS enrolments (
+    username TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    PRIMARY KEY (username, subject)
+);
+CREATE INDEX IF NOT EXISTS idx_enrolments_subject ON enrolments (subject);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# The accounts the app has always shipped with for trying it out
+DEMO_USERS = [
+    ('student1', 'pass123', 'John Doe', 3),
+    ('student2', 'pass456', 'Jane Smith', 5),
+]
+
+
+def hash_password(password, iterations, salt=None):
+    """``pbkdf2_sha256$<iterations>$<salt>$<hash>`` for ``password`` with a new random salt"""
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password, encoded):
+    """True if ``password`` matches a hash from ``hash_password``"""
+    try:
+        algorithm, iterations, salt, expected = encoded.split('$')
+        salt, iterations = bytes.fromhex(salt), int(iterations)
+    except ValueError:
+        return False
+    if algorithm != 'pbkdf2_sha256' or iterations < 1:
+        return False
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class UserStore:
+    """Users keyed by username, with their enrolled subjects.
+
+    Each thread gets its own connection, so concurrent logins only
+    serialize on SQLite writes (rare: rehashes and logouts). ``secret``
+    signs session tokens; without one, a random secret is generated once
+    and kept in the database, so workers sharing the file agree on it.
+    """
+
+    def __init__(self, path, iterations=200_000, secret=None, token_ttl=12 * 3600, busy_timeout=5.0):
+        self.path = path
+        self.iterations = iterations
+        self.token_ttl = token_ttl
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {'logins': 0, 'failed_logins': 0, 'rehashes': 0, 'tokens_issued': 0,
+                      'tokens_accepted': 0, 'tokens_rejected': 0}
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        self._secret = (secret or self._stored_secret()).encode()
+        # Compared against when the username is unknown, so a miss costs as much as a wrong password
+        self._dummy_hash = hash_password(secrets.token_hex(8), iterations)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _stored_secret(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('token_secret', ?)",
+                         (secrets.token_hex(32),))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return conn.execute("SELECT value FROM meta WHERE key = 'token_secret'").fetchone()[0]
+
+    def add_user(self, username, password, name, semester, subjects=None):
+        """Create or replace a user; ``subjects`` defaults to the semester's subjects"""
+        self.add_users([(username, password, name, semester, subjects)])
+
+    def add_users(self, users):
+        """Create or replace ``(username, password, name, semester, subjects)`` rows in one transaction"""
+        rows = [(username, name, int(semester), hash_password(password, self.iterations),
+                 SUBJECTS_BY_SEMESTER.get(int(semester), []) if subjects is None else subjects)
+                for username, password, name, semester, subjects in users]
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO users (username, name, semester, password_hash, created_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (username) DO UPDATE SET name = excluded.name, semester = excluded.semester, '
+                'password_hash = excluded.password_hash, session_version = session_version + 1',
+                [(username, name, semester, password_hash, now)
+                 for username, name, semester, password_hash, _ in rows])
+            conn.executemany('DELETE FROM enrolments WHERE username = ?', [(row[0],) for row in rows])
+            conn.executemany('INSERT OR IGNORE INTO enrolments (username, subject) VALUES (?, ?)',
+                             [(row[0], subject) for row in rows for subject in row[4]])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def seed(self, users):
+        """Add ``(username, password, name, semester)`` users that do not exist yet"""
+        existing = {row[0] for row in self._conn().execute('SELECT username FROM users')}
+        return self.add_users([user + (None,) for user in users if user[0] not in existing])
+
+    def get(self, username):
+        """``{"username", "name", "semester", "subjects"}`` for ``username``, or None"""
+        conn = self._conn()
+        row = conn.execute('SELECT name, semester FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            return None
+        subjects = [subject for (subject,) in conn.execute(
+            'SELECT subject FROM enrolments WHERE username = ? ORDER BY rowid', (username,))]
+        return {'username': username, 'name': row[0], 'semester': row[1], 'subjects': subjects}
+
+    def authenticate(self, username, password):
+        """The user if ``password`` is right, else None"""
+        conn = self._conn()
+        row = conn.execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()
+        if not check_password(password, row[0] if row else self._dummy_hash) or row is None:
+            self._count('failed_logins')
+            return None
+        if int(row[0].split('$')[1]) < self.iterations:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('UPDATE users SET password_hash = ? WHERE username = ?',
+                             (hash_password(password, self.iterations), username))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._count('rehashes')
+        self._count('logins')
+        return self.get(username)
+
+    def issue_token(self, username):
+        """A signed token that ``verify_token`` accepts until it expires or the user's sessions are revoked"""
+        row = self._conn().execute('SELECT session_version FROM users WHERE username = ?', (username,)).fetchone()
+        payload = _b64encode(json.dumps({'u': username, 'v': row[0], 'exp': int(time.time() + self.token_ttl)},
+                                        separators=(',', ':')).encode())
+        self._count('tokens_issued')
+        return f"{payload}.{self._sign(payload)}"
+
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self._secret, payload.encode(), hashlib.sha256).digest())
+
+    def verify_token(self, token):
+        """The user a token was issued to, or None if it is forged, expired or revoked"""
+        try:
+            payload, signature = token.split('.')
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                raise ValueError('bad signature')
+            claims = json.loads(_b64decode(payload))
+            if claims['exp'] < time.time():
+                raise ValueError('expired')
+            row = self._conn().execute('SELECT session_version FROM users WHERE username = ?',
+                                       (claims['u'],)).fetchone()
+            if row is None or row[0] != claims['v']:
+                raise ValueError('revoked')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._count('tokens_rejected')
+            return None
+        self._count('tokens_accepted')
+        return self.get(claims['u'])
+
+    def revoke_sessions(self, username):
+        """Invalidate every token issued to ``username`` so far"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE users SET session_version = session_version + 1 WHERE username = ?', (username,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+
+def main(argv=None):
+    import settings
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default=settings.USERS_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='create or replace one user, prompting for the password')
+    add.add_argument('username')
+    add.add_argument('--name', required=True)
+    add.add_argument('--semester', type=int, required=True)
+    add.add_argument('--subject', action='append', dest='subjects', help="enrol in a subject (default: the semester's)")
+    load = commands.add_parser('import', help='create or replace users from a CSV file')
+    load.add_argument('csv', help='columns username,password,name,semester and optionally subjects (";"-separated)')
+    args = parser.parse_args(argv)
+
+    store = UserStore(args.path, iterations=settings.PASSWORD_ITERATIONS)
+    if args.command == 'add':
+        store.add_user(args.username, getpass.getpass(f"Password for {args.username}: "), args.name,
+                       args.semester, args.subjects)
+        print(f"Saved {args.username}")
+    else:
+        with open(args.csv, newline='') as f:
+            rows = [(row['username'], row['password'], row['name'], row['semester'],
+                     [s.strip() for s in row['subjects'].split(';') if s.strip()] if row.get('subjects') else None)
+                    for row in csv.DictReader(f)]
+        print(f"Imported {store.add_users(rows)} users")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Pre-generate test structures and fill the question bank before an exam.
+
+Walks every subject offered by the app (or the ones given), caches and
+optionally pins its topic structure, then tops up every topic x level to
+``--target`` questions in the bank. Model calls run in worker threads,
+with at most ``--concurrency`` in flight, through the same model routing,
+rate limits and retries the app uses. The bank is the checkpoint: a rerun
+only generates what is still missing, and exact and near duplicates are
+dropped.
+Throughput is bounded by ADAPTIVE_RATE_LIMIT_PER_SECOND, which can be
+raised for a night run when nobody else shares the quota.
+
+    python warmup.py --target 40 --concurrency 8 --pin
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import settings
+from engine import LEVELS
+from providers import FakeProvider, GeminiProvider
+from question_bank import QuestionBank
+from router import route_models
+from structure_cache import StructureCache
+from subjects import all_subjects
+
+
+class WarmUp:
+    """One warm-up run: the stores, the provider, a concurrency limit and progress counters"""
+
+    def __init__(self, provider, bank, cache, target, batch_size, concurrency, pin=False, max_stalls=3):
+        self.provider = provider
+        self.bank = bank
+        self.cache = cache
+        self.target = target
+        self.batch_size = batch_size
+        self.pin = pin
+        self.max_stalls = max_stalls
+        self._limit = asyncio.Semaphore(concurrency)
+        self.stats = {'subjects': 0, 'cells': 0, 'cells_done': 0, 'calls': 0, 'stored': 0,
+                      'duplicates': 0, 'errors': 0}
+        self.failures = []
+
+    async def _run(self, fn, *args):
+        async with self._limit:
+            return await asyncio.to_thread(fn, *args)
+
+    def _generate_structure(self, subject):
+        self.stats['calls'] += 1
+        return self.provider.generate_structure(subject)
+
+    async def subject(self, subject):
+        """Cache the structure for ``subject``, then fill all of its topic x level cells concurrently"""
+        try:
+            structure = await self._run(self.cache.get, subject, self._generate_structure)
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.failures.append((subject, None, None, str(e)))
+            return
+        if self.pin:
+            self.cache.pin(subject, structure)
+        self.stats['subjects'] += 1
+        cells = [(topic, level) for topic in structure['topics'] for level in LEVELS]
+        self.stats['cells'] += len(cells)
+        await asyncio.gather(*(self.cell(subject, topic, level) for topic, level in cells))
+
+    async def cell(self, subject, topic, level):
+        """Generate batches for one topic and level until the bank holds ``target`` questions"""
+        stalls = 0
+        held = self.bank.count(subject, topic['name'], level)
+        while stalls < self.max_stalls and held < self.target:
+            missing = self.target - held
+            try:
+                self.stats['calls'] += 1
+                questions = await self._run(self.provider.generate_questions, subject, topic['name'],
+                                            topic['subtopics'], level, min(self.batch_size, missing))
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.failures.append((subject, topic['name'], level, str(e)))
+                stalls += 1
+                continue
+            await asyncio.to_thread(self.bank.add, subject, topic['name'], level, questions)
+            # Only this task writes to the cell, so the change in its count is what was new
+            before, held = held, self.bank.count(subject, topic['name'], level)
+            stored = held - before
+            self.stats['stored'] += stored
+            self.stats['duplicates'] += len(questions) - stored
+            stalls = 0 if stored else stalls + 1
+        self.stats['cells_done'] += 1
+
+    async def run(self, subjects, report_every=5.0):
+        start = time.perf_counter()
+        reporter = asyncio.create_task(self._report(start, report_every))
+        try:
+            await asyncio.gather(*(self.subject(subject) for subject in subjects))
+        finally:
+            reporter.cancel()
+        self._print_progress(start)
+        return time.perf_counter() - start
+
+    async def _report(self, start, every):
+        while True:
+            await asyncio.sleep(every)
+            self._print_progress(start)
+
+    def _print_progress(self, start):
+        elapsed = time.perf_counter() - start
+        s = self.stats
+        print(f"[{elapsed:7.1f}s] subjects {s['subjects']}  cells {s['cells_done']}/{s['cells']}  "
+              f"calls {s['calls']}  stored {s['stored']} ({s['stored'] / max(elapsed, 1e-9):.1f}/s)  "
+              f"duplicates {s['duplicates']}  errors {s['errors']}", flush=True)
+
+
+def build_provider(name, api_key=None):
+    if name == 'fake':
+        models = {route: FakeProvider(latency=settings.FAKE_LATENCY, failure_rate=settings.FAKE_FAILURE_RATE,
+                                      seed=settings.FAKE_SEED + (route == 'fast'))
+                  for route in ('fast', 'strong')}
+    elif name == 'gemini':
+        if not api_key:
+            sys.exit("Set GEMINI_API_KEY or pass --api-key")
+        models = {'fast': GeminiProvider(api_key, settings.MODEL_FAST),
+                  'strong': GeminiProvider(api_key, settings.MODEL_STRONG)}
+    else:
+        sys.exit(f"Cannot warm up from provider {name!r}")
+    return route_models(models)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('subjects', nargs='*', help='subjects to warm up (default: every subject offered)')
+    parser.add_argument('--target', type=int, default=settings.POOL_MAX_PER_STATE,
+                        help='questions to hold per topic and level')
+    parser.add_argument('--batch-size', type=int, default=settings.QUESTION_BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=8, help='model calls in flight at once')
+    parser.add_argument('--provider', default=settings.PROVIDER, choices=('gemini', 'fake'))
+    parser.add_argument('--api-key', default=os.environ.get('GEMINI_API_KEY'))
+    parser.add_argument('--pin', action='store_true', help='pin structures so they do not expire before the exam')
+    parser.add_argument('--report-every', type=float, default=5.0, help='seconds between progress lines')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    warmup = WarmUp(
+        build_provider(args.provider, args.api_key),
+        QuestionBank(settings.BANK_PATH,
+                     near_duplicate_threshold=settings.DEDUP_THRESHOLD if settings.DEDUP_ENABLED else None),
+        StructureCache(settings.STRUCTURE_CACHE_PATH, ttl=settings.STRUCTURE_CACHE_TTL,
+                       max_entries=settings.STRUCTURE_CACHE_SIZE),
+        target=args.target,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        pin=args.pin,
+    )
+    elapsed = asyncio.run(warmup.run(args.subjects or all_subjects(), args.report_every))
+    for subject, topic, level, error in warmup.failures[:20]:
+        print(f"  failed: {subject} / {topic or '(structure)'} / {level or '-'}: {error}")
+    print(f"Stored {warmup.stats['stored']} questions in {elapsed:.1f}s "
+          f"({warmup.stats['stored'] / max(elapsed, 1e-9):.1f}/s) with {warmup.stats['calls']} calls")
+    return 1 if warmup.stats['errors'] and not warmup.stats['stored'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())